@@ -0,0 +1,116 @@
+"""
+Concurrent-request benchmark for flask_app.
+
+Simulates users who each request a kinship block for a random set of lines.
+Every user runs in its own thread against the same pedigree graph, the way
+threaded Flask workers do, so throughput only grows with the user count while
+the numba kernels release the GIL. The user count goes up to the number of
+cores. A final check runs matrix builds on request threads in a fresh
+interpreter and fails if that interpreter does not exit.
+
+    python benchmarks/bench_concurrency.py                  # 1, 2, 4, ... cores users
+    python benchmarks/bench_concurrency.py --users 1 4 8 --lines 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import flask_app  # noqa: E402
+
+# Runs in the child interpreter: a parallel-sized packed build, a block-diagonal
+# build and a crossing block, each on its own thread, as Flask would serve them.
+EXIT_CHILD = """
+import threading
+import flask_app
+flask_app.pedigree_ready.wait()
+graph = flask_app.get_pedigree_graph()
+names = [graph.names[i] for i in range(graph.n_lines)]
+lines = names[: flask_app.PARALLEL_MATRIX_MIN_LINES + 500]
+jobs = [
+    lambda: flask_app.compute_packed_lines(lines, graph),
+    lambda: flask_app.compute_block_diagonal_matrix(flask_app.split_pedigree_components(lines, graph)),
+    lambda: flask_app.evaluate_crossing_block(names[:300], names[300:600], graph),
+]
+threads = [threading.Thread(target=job) for job in jobs]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+"""
+
+
+def check_exit(timeout: float) -> float:
+    """Seconds the child interpreter took to finish and exit; exits with an error if it hangs."""
+    start = time.perf_counter()
+    try:
+        subprocess.run([sys.executable, "-c", EXIT_CHILD], cwd=REPO_DIR, capture_output=True, check=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        sys.exit(f"exit check: interpreter still running after {timeout:.0f} s")
+    return time.perf_counter() - start
+
+
+def user_counts(cores: int) -> list[int]:
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def run_round(graph, names: np.ndarray, users: int, requests: int, lines: int, seed: int) -> float:
+    """Serve `requests` kinship blocks per user on `users` threads; returns requests per second."""
+    rng = np.random.default_rng(seed)
+    jobs = [rng.choice(names, size=min(lines, len(names)), replace=False).tolist() for _ in range(users * requests)]
+
+    def serve(selection: list[str]) -> None:
+        half = len(selection) // 2
+        flask_app.kinship_block(selection[:half], selection[half:], graph)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(serve, jobs))
+    return len(jobs) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", help="concurrent user counts (default: powers of two up to the core count)")
+    parser.add_argument("--requests", type=int, default=4, help="requests per user in each round")
+    parser.add_argument("--lines", type=int, default=1000, help="lines per request, split into candidates and references")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--exit-timeout", type=float, default=120.0, help="seconds allowed for the exit check")
+    args = parser.parse_args()
+
+    flask_app.pedigree_ready.wait()
+    graph = flask_app.get_pedigree_graph()
+    names = np.array([graph.names[i] for i in range(graph.n_lines)], dtype=object)
+    counts = args.users or user_counts(os.cpu_count() or 1)
+
+    # One untimed request compiles or loads the kernels.
+    run_round(graph, names, 1, 1, args.lines, seed=0)
+    print(f"{graph.n_lines:,} pedigree lines, {args.lines:,} lines per request, {os.cpu_count()} cores")
+    print(f"{'users':>6}{'requests/s':>14}{'speedup':>10}   median of {args.runs} runs")
+    baseline = None
+    for users in counts:
+        rate = statistics.median(run_round(graph, names, users, args.requests, args.lines, seed=run) for run in range(args.runs))
+        baseline = baseline or rate
+        print(f"{users:>6}{rate:>14.2f}{rate / baseline:>10.2f}")
+    print(f"exit check: ok in {check_exit(args.exit_timeout):.1f} s")
+
+
+if __name__ == "__main__":
+    main()
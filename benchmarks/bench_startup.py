@@ -0,0 +1,105 @@
+"""
+Startup-time benchmark for flask_app.
+
+Each run starts a fresh interpreter, imports flask_app and polls /ready through
+the Flask test client. It reports the time until the import returns (when a
+worker could start serving) and until the pedigree is indexed. It then times
+the path that skips the snapshot, as uploads and edited files take: parsing
+the text, normalizing it, filtering it and building the graph from categorical
+codes.
+
+    python benchmarks/bench_startup.py                 # both modes, 5 runs each
+    python benchmarks/bench_startup.py --runs 10 --mode background
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Runs in the child interpreter; prints one JSON line with the timings.
+CHILD = """
+import json, time
+start = time.perf_counter()
+import flask_app
+imported = time.perf_counter() - start
+client = flask_app.app.server.test_client()
+while client.get("/ready").status_code != 200:
+    time.sleep(0.005)
+ready = time.perf_counter() - start
+print(json.dumps({"import": imported, "ready": ready}))
+"""
+
+# Runs in the child interpreter; times each text-load stage and prints the
+# medians over the runs as one JSON line.
+PARSE_CHILD = """
+import json, statistics, sys, time
+import pandas as pd
+import flask_app
+flask_app.pedigree_ready.wait()
+path = flask_app.USER_FILE if flask_app.USER_FILE.exists() else flask_app.DEFAULT_FILE
+flask_app.PedigreeGraph.from_dataframe(flask_app.filtered_df)
+stages = {"read": [], "normalize": [], "filter": [], "graph": []}
+for _ in range(int(sys.argv[1])):
+    start = time.perf_counter()
+    raw = pd.read_csv(path, sep="," if path.suffix.lower() == ".csv" else "\\t")
+    read = time.perf_counter()
+    source_df = flask_app.normalize_pedigree_df(raw)
+    normalized = time.perf_counter()
+    filtered = flask_app.compute_filtered_df(source_df)
+    filtered_at = time.perf_counter()
+    flask_app.PedigreeGraph.from_dataframe(filtered)
+    done = time.perf_counter()
+    for stage, seconds in zip(stages, (read - start, normalized - read, filtered_at - normalized, done - filtered_at)):
+        stages[stage].append(seconds)
+print(json.dumps({"rows": len(raw), **{stage: statistics.median(times) for stage, times in stages.items()}}))
+"""
+
+
+def run_once(background: bool) -> dict[str, float]:
+    env = {**os.environ, "CANECESTRY_BACKGROUND_INDEXING": "1" if background else "0"}
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_parse(runs: int) -> dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, "-c", PARSE_CHILD, str(runs)], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mode", choices=["foreground", "background", "both"], default="both")
+    args = parser.parse_args()
+
+    modes = ["foreground", "background"] if args.mode == "both" else [args.mode]
+    # One untimed run so the pedigree snapshot and bytecode caches exist.
+    run_once(background=False)
+    print(f"{'mode':<12}{'import (s)':>12}{'ready (s)':>12}   median of {args.runs} runs")
+    for mode in modes:
+        runs = [run_once(background=mode == "background") for _ in range(args.runs)]
+        imported = statistics.median(run["import"] for run in runs)
+        ready = statistics.median(run["ready"] for run in runs)
+        print(f"{mode:<12}{imported:>12.3f}{ready:>12.3f}")
+
+    parse = run_parse(max(args.runs, 5))
+    stages = ["read", "normalize", "filter", "graph"]
+    print(f"\ntext load of {parse['rows']:,} rows without a snapshot (ms, median of {max(args.runs, 5)} runs)")
+    print("".join(f"{stage:>11}" for stage in stages + ["total"]))
+    print("".join(f"{parse[stage] * 1e3:>11.1f}" for stage in stages) + f"{sum(parse[s] for s in stages) * 1e3:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,33 +15,45 @@ Fixed version generated from the uploaded app:
 from __future__ import annotations
 
 import base64
+import hashlib
+import json
 import os
 import re
+import shutil
+import threading
 import time
 import urllib.parse
-from collections import defaultdict, deque
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import TYPE_CHECKING, Iterable, Optional
+
+# Numba's TBB layer, when first started from a request thread, keeps the
+# interpreter from exiting; OpenMP and workqueue do not. Set before numba is
+# imported; an explicit NUMBA_THREADING_LAYER still wins.
+os.environ.setdefault("NUMBA_THREADING_LAYER_PRIORITY", "omp workqueue tbb")
 
 import dash
 import dash_bootstrap_components as dbc
 import flask
-import graphviz
-import matplotlib
-
-matplotlib.use("Agg")
-import matplotlib.cm as cm
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import seaborn as sns
 import plotly.graph_objects as go
 from dash import ALL, Input, Output, State, dcc, html
 from dash.exceptions import PreventUpdate
 from flask import Flask, send_file
-from matplotlib.colors import Normalize
-from numba import njit
+from numba import get_num_threads, njit, prange, threading_layer, types
+
+# seaborn/matplotlib, graphviz and scipy are imported inside the functions that
+# use them, so workers and reloads do not pay for them before the first request.
+if TYPE_CHECKING:
+    import graphviz
+    from scipy import sparse
 
 try:
     import dash_cytoscape as cyto
@@ -50,11 +62,44 @@ except Exception:
     cyto = None
     HAS_CYTOSCAPE = False
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except Exception:
+    pa = None
+    pq = None
+    HAS_PYARROW = False
+
 # =============================================================================
 # Configuration
 # =============================================================================
 
 MAX_CLUSTER_SIZE = 300
+# Working-memory cap for one batch of Colleau A·X columns (ancestors × batch × 8 bytes).
+COLLEAU_BATCH_BYTES = 256 * 1024 ** 2
+# Matrices whose dense size (lines² × 8 bytes) exceeds this are streamed to a
+# memory-mapped .npy file under OUTPUT_DIR instead of being held in RAM.
+MATRIX_RAM_BUDGET_BYTES = 1024 ** 3
+# Heatmaps and ordination of stored matrices use at most this many evenly spaced lines.
+MAX_PLOT_LINES = 2000
+# Matrix CSV downloads are streamed in blocks of about this many bytes, with fixed decimals.
+MATRIX_CSV_CHUNK_BYTES = 16 * 1024 ** 2
+MATRIX_CSV_DECIMALS = 6
+# Below this many lines (or with a single numba thread) the serial Henderson kernel is faster.
+PARALLEL_MATRIX_MIN_LINES = 2000
+# Unrelated groups smaller than this share one block; blocks are only used when
+# the zeros between them are at least this fraction of the packed triangle.
+BLOCK_MIN_LINES = 256
+BLOCK_MIN_SAVING = 0.5
+# Full-sib families are stored once per family when lines outnumber families by this factor.
+FAMILY_COMPRESSION_MIN_RATIO = 2.0
+# Pairwise kinship queries keep intermediate pair values per pedigree graph, up to
+# this many bytes. An entry (int key, float value, LRU links) costs about
+# KINSHIP_MEMO_ENTRY_BYTES, so 16 MB is about 100k pairs; both the full and the
+# filtered pedigree graphs can hold a memo.
+KINSHIP_MEMO_BYTES = 16 * 1024 ** 2
+KINSHIP_MEMO_ENTRY_BYTES = 170
 REQUIRED_PEDIGREE_COLUMNS = ["LineName", "FemaleParent", "MaleParent"]
 PATTERN_POLY_P = re.compile(r"^\d*[pP]\d*$")
 
@@ -65,9 +110,26 @@ USER_INPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 DEFAULT_FILE = PEDIGREE_DIR / "Pedigree_Subset.txt"
 USER_FILE = USER_INPUT_DIR / "pedigree.txt"
+# Normalized pedigrees and their compiled graphs, reused at startup while the text file is unchanged.
+PEDIGREE_SNAPSHOT_DIR = PEDIGREE_DIR / "snapshots"
+PEDIGREE_SNAPSHOT_VERSION = 1
+# With CANECESTRY_BACKGROUND_INDEXING=1 the server starts answering at once and
+# loads/indexes the pedigrees in a thread; /ready returns 503 until that is done.
+BACKGROUND_INDEXING = os.environ.get("CANECESTRY_BACKGROUND_INDEXING", "").lower() in {"1", "true", "yes"}
+# With CANECESTRY_WARMUP_KERNELS=1 the numba kernels are compiled (or loaded from
+# their on-disk cache) during startup, before /ready reports ready.
+WARMUP_KERNELS = os.environ.get("CANECESTRY_WARMUP_KERNELS", "").lower() in {"1", "true", "yes"}
 
 OUTPUT_DIR = BASE_DIR / "matrices"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+MATRIX_CACHE_DIR = OUTPUT_DIR / "cache"
+MATRIX_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+# Cached matrices, heatmaps and CSV exports are evicted least-recently-used first above this size.
+MATRIX_CACHE_BYTES = 20 * 1024 ** 3
+# How many recent cached matrices are checked as a starting point to extend, and
+# the share of the new lines one must already hold; below that a fresh build is faster.
+MATRIX_EXTEND_CANDIDATES = 8
+MATRIX_EXTEND_MIN_FRACTION = 0.5
 
 server = Flask(__name__)
 app = dash.Dash(
@@ -152,16 +214,33 @@ DOWNLOAD_BUTTON_STYLE = {
 # =============================================================================
 
 
+PARENT_PLACEHOLDERS = frozenset({"", ".", "0", "na", "nan", "none", "unknown"})
+
+
 def clean_parent_value(value) -> Optional[str]:
     """Convert blank/placeholder parent values to None and strip valid names."""
     if pd.isna(value):
         return None
     value = str(value).strip()
-    if value.lower() in {"", ".", "0", "na", "nan", "none", "unknown"}:
+    if value.lower() in PARENT_PLACEHOLDERS:
         return None
     return value
 
 
+def factorize_parent_values(values: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Categorical codes for a parent column and clean_parent_value of each category.
+
+    Parent names repeat heavily, so only the distinct values are cleaned, with
+    string ops. The last category is None and missing values point to it
+    (code -1).
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    text = pd.Index(uniques).astype(str).str.strip()
+    cleaned = np.append(np.where(text.str.lower().isin(PARENT_PLACEHOLDERS), None, text.to_numpy(dtype=object)), None)
+    return codes, cleaned
+
+
 def normalize_pedigree_df(raw_df: pd.DataFrame) -> pd.DataFrame:
     """Validate and normalize a pedigree dataframe."""
     missing = [col for col in REQUIRED_PEDIGREE_COLUMNS if col not in raw_df.columns]
@@ -172,15 +251,15 @@ def normalize_pedigree_df(raw_df: pd.DataFrame) -> pd.DataFrame:
             + f". Missing: {', '.join(missing)}"
         )
 
-    out = raw_df[REQUIRED_PEDIGREE_COLUMNS].copy()
-    out["LineName"] = out["LineName"].astype(str).str.strip()
-    out = out[out["LineName"].ne("")].copy()
-    out = out.drop_duplicates(subset=["LineName"], keep="first")
-
+    line_names = raw_df["LineName"].astype(str).str.strip()
+    rows = np.flatnonzero((line_names.ne("") & ~line_names.duplicated(keep="first")).to_numpy())
+    out = {"LineName": line_names.to_numpy()[rows]}
     for col in ["FemaleParent", "MaleParent"]:
-        out[col] = out[col].map(lambda x: clean_parent_value(x) or "")
+        codes, cleaned = factorize_parent_values(raw_df[col])
+        cleaned[pd.isna(cleaned)] = ""
+        out[col] = cleaned[codes[rows]]
 
-    return out.reset_index(drop=True)
+    return pd.DataFrame(out, columns=REQUIRED_PEDIGREE_COLUMNS)
 
 
 def read_pedigree_file(path: Path) -> pd.DataFrame:
@@ -193,12 +272,13 @@ def read_pedigree_file(path: Path) -> pd.DataFrame:
     return normalize_pedigree_df(raw)
 
 
-def load_current_pedigree() -> pd.DataFrame:
+def load_current_pedigree() -> tuple[pd.DataFrame, pd.DataFrame, PedigreeGraph]:
+    """(df, filtered_df, filtered graph) for the user pedigree if present, else the default one."""
     if USER_FILE.exists():
         print(f"Loading USER pedigree: {USER_FILE}")
-        return read_pedigree_file(USER_FILE)
+        return read_pedigree_snapshot(USER_FILE)
     print(f"Loading DEFAULT pedigree: {DEFAULT_FILE}")
-    return read_pedigree_file(DEFAULT_FILE)
+    return read_pedigree_snapshot(DEFAULT_FILE)
 
 
 def compute_filtered_df(source_df: pd.DataFrame) -> pd.DataFrame:
@@ -211,33 +291,400 @@ def compute_filtered_df(source_df: pd.DataFrame) -> pd.DataFrame:
     """
     if source_df.empty:
         return source_df.copy()
+    return source_df.loc[informative_row_mask(source_df)].reset_index(drop=True)
 
-    parent_values = pd.concat(
-        [source_df["MaleParent"], source_df["FemaleParent"]], ignore_index=True
-    ).map(clean_parent_value)
-    parents_set = set(parent_values.dropna().tolist())
 
-    has_no_parents = source_df["MaleParent"].map(clean_parent_value).isna() & source_df[
-        "FemaleParent"
-    ].map(clean_parent_value).isna()
-    is_not_used_as_parent = ~source_df["LineName"].isin(parents_set)
-    isolated_mask = has_no_parents & is_not_used_as_parent
-    return source_df.loc[~isolated_mask].reset_index(drop=True)
+def informative_row_mask(source_df: pd.DataFrame) -> pd.Series:
+    """Boolean mask of the rows compute_filtered_df keeps."""
+    male_codes, male_names = factorize_parent_values(source_df["MaleParent"])
+    female_codes, female_names = factorize_parent_values(source_df["FemaleParent"])
+    parent_values = np.concatenate([male_names[:-1], female_names[:-1]])
+    parent_values = parent_values[pd.notna(parent_values)]
 
+    has_no_parents = pd.isna(male_names)[male_codes] & pd.isna(female_names)[female_codes]
+    is_not_used_as_parent = ~source_df["LineName"].isin(parent_values).to_numpy()
+    return pd.Series(~(has_no_parents & is_not_used_as_parent), index=source_df.index)
 
-try:
-    default_df = read_pedigree_file(DEFAULT_FILE)
-except Exception as exc:
-    print(f"WARNING: Could not load default pedigree: {exc}")
-    default_df = pd.DataFrame(columns=REQUIRED_PEDIGREE_COLUMNS)
 
-try:
-    df = load_current_pedigree()
-except Exception as exc:
-    print(f"WARNING: Could not load current pedigree: {exc}")
-    df = default_df.copy()
+@njit(cache=True, nogil=True)
+def _topological_order_numba(child_ptr, child_ids, indegree, n_lines):
+    """
+    Kahn order of rows 0..n_lines-1, first-in first-out from the rows without
+    row parents. Returns the order and how many rows it reached; rows caught in
+    cycles follow in row order.
+    """
+    order = np.empty(n_lines, dtype=np.int32)
+    head = 0
+    tail = 0
+    for i in range(n_lines):
+        if indegree[i] == 0:
+            order[tail] = i
+            tail += 1
+    while head < tail:
+        node = order[head]
+        head += 1
+        for k in range(child_ptr[node], child_ptr[node + 1]):
+            child = child_ids[k]
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                order[tail] = child
+                tail += 1
+    n_sorted = tail
+    for i in range(n_lines):
+        if indegree[i] > 0:
+            order[tail] = i
+            tail += 1
+    return order, n_sorted
+
+
+def _csr_gather(ptr: np.ndarray, values: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Concatenate the CSR slices values[ptr[r]:ptr[r + 1]] for every r in rows."""
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return values[:0]
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    return values[offsets]
+
+
+@dataclass(frozen=True)
+class PedigreeGraph:
+    """
+    Integer-indexed pedigree compiled once per active dataframe.
+
+    Line names are interned to int32 ids. Ids below ``n_lines`` are LineName rows
+    in dataframe order; the remaining ids are parents that are referenced but have
+    no row of their own. Parent ids use -1 for unknown. Children are stored in CSR
+    form (``child_ptr``/``child_ids``) in row order, male parent edge first, which
+    is the order the old dictionary lookups produced. ``topo_order`` holds the row
+    ids with parents before children, using the same queue order as
+    ``sort_pedigree_df``; rows caught in cycles are appended at the end.
+    ``derived`` memoizes whole-pedigree results such as the inbreeding vector.
+
+    The index arrays are made read-only on construction, so one graph can be
+    shared by concurrent requests without copying; kernels only ever receive
+    per-request arrays derived from it.
+    """
+
+    names: list[str]
+    index: dict[str, int]
+    n_lines: int
+    sires: np.ndarray
+    dams: np.ndarray
+    child_ptr: np.ndarray
+    child_ids: np.ndarray
+    topo_order: np.ndarray
+    topo_rank: np.ndarray
+    n_unresolved: int
+    derived: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def __post_init__(self) -> None:
+        for array in (self.sires, self.dams, self.child_ptr, self.child_ids, self.topo_order, self.topo_rank):
+            array.setflags(write=False)
+
+    @classmethod
+    def from_dataframe(cls, source_df: pd.DataFrame) -> "PedigreeGraph":
+        # Rows and parents are handled as categorical codes; names are only
+        # looked up once per distinct value.
+        row_codes, line_names = pd.factorize(source_df["LineName"].astype(str))
+        male_codes, male_names = factorize_parent_values(source_df["MaleParent"])
+        female_codes, female_names = factorize_parent_values(source_df["FemaleParent"])
+
+        names = line_names.tolist()
+        n_lines = len(names)
+        line_index = pd.Index(names)
+        parent_values = pd.unique(np.concatenate([male_names[:-1], female_names[:-1]]))
+        parent_values = parent_values[pd.notna(parent_values)]
+        names.extend(parent_values[~pd.Index(parent_values).isin(line_index)].tolist())
+        node_index = pd.Index(names)
+        n_nodes = len(names)
+
+        row_ids = row_codes.astype(np.int32)
+        male_ids = np.append(node_index.get_indexer(male_names[:-1]), -1).astype(np.int32)[male_codes]
+        female_ids = np.append(node_index.get_indexer(female_names[:-1]), -1).astype(np.int32)[female_codes]
+
+        sires = np.full(n_nodes, -1, dtype=np.int32)
+        dams = np.full(n_nodes, -1, dtype=np.int32)
+        sires[row_ids] = male_ids
+        dams[row_ids] = female_ids
+
+        edge_parents = np.column_stack([male_ids, female_ids]).ravel()
+        edge_children = np.repeat(row_ids, 2)
+        valid = edge_parents >= 0
+        edge_parents = edge_parents[valid]
+        edge_children = edge_children[valid]
+        order = np.argsort(edge_parents, kind="stable")
+        child_ids = edge_children[order].astype(np.int32)
+        child_ptr = np.zeros(n_nodes + 1, dtype=np.int32)
+        np.cumsum(np.bincount(edge_parents, minlength=n_nodes), out=child_ptr[1:])
+
+        # Kahn ordering over LineName rows only. Parents without a row of their own
+        # never block a child, exactly as in the original dataframe sort.
+        row_edges = edge_parents < n_lines
+        indegree = np.bincount(edge_children[row_edges], minlength=n_lines)
+        topo_order, n_sorted = _topological_order_numba(child_ptr, child_ids, indegree, n_lines)
+        topo_rank = np.empty(n_lines, dtype=np.int32)
+        topo_rank[topo_order] = np.arange(n_lines, dtype=np.int32)
+
+        return cls(
+            names=names,
+            index=dict(zip(names, range(n_nodes))),
+            n_lines=n_lines,
+            sires=sires,
+            dams=dams,
+            child_ptr=child_ptr,
+            child_ids=child_ids,
+            topo_order=topo_order,
+            topo_rank=topo_rank,
+            n_unresolved=n_lines - int(n_sorted),
+        )
+
+    def to_arrays(self, prefix: str = "") -> dict[str, np.ndarray]:
+        """Plain arrays for an .npz snapshot; from_arrays reverses this."""
+        return {
+            f"{prefix}names": np.array(self.names, dtype=str),
+            f"{prefix}counts": np.array([self.n_lines, self.n_unresolved], dtype=np.int64),
+            f"{prefix}sires": self.sires,
+            f"{prefix}dams": self.dams,
+            f"{prefix}child_ptr": self.child_ptr,
+            f"{prefix}child_ids": self.child_ids,
+            f"{prefix}topo_order": self.topo_order,
+            f"{prefix}topo_rank": self.topo_rank,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix: str = "") -> "PedigreeGraph":
+        names = arrays[f"{prefix}names"].tolist()
+        n_lines, n_unresolved = arrays[f"{prefix}counts"].tolist()
+        return cls(
+            names=names,
+            index={name: i for i, name in enumerate(names)},
+            n_lines=n_lines,
+            sires=arrays[f"{prefix}sires"],
+            dams=arrays[f"{prefix}dams"],
+            child_ptr=arrays[f"{prefix}child_ptr"],
+            child_ids=arrays[f"{prefix}child_ids"],
+            topo_order=arrays[f"{prefix}topo_order"],
+            topo_rank=arrays[f"{prefix}topo_rank"],
+            n_unresolved=n_unresolved,
+        )
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.names)
+
+    def has_line(self, name: str) -> bool:
+        """True when name has its own LineName row."""
+        node = self.index.get(name)
+        return node is not None and node < self.n_lines
+
+    def parent_ids(self, parent_col: str) -> np.ndarray:
+        return self.sires if parent_col == "MaleParent" else self.dams
+
+    def parents(self, name: str) -> tuple[Optional[str], Optional[str]]:
+        """Return (male, female) parent names, or (None, None) for unknown lines."""
+        node = self.index.get(name)
+        if node is None:
+            return None, None
+        sire = int(self.sires[node])
+        dam = int(self.dams[node])
+        return (self.names[sire] if sire >= 0 else None, self.names[dam] if dam >= 0 else None)
+
+    def children_of(self, node: int) -> np.ndarray:
+        return self.child_ids[self.child_ptr[node]:self.child_ptr[node + 1]]
+
+    def ids(self, names: Iterable[str]) -> np.ndarray:
+        """Map names to ids, silently skipping names that are not in the pedigree."""
+        found = [self.index[name] for name in names if name in self.index]
+        return np.asarray(found, dtype=np.int32)
+
+    def ancestor_ids(self, seeds: np.ndarray) -> np.ndarray:
+        """Return sorted ids of the seeds plus every recorded ancestor."""
+        mask = np.zeros(self.n_nodes, dtype=bool)
+        frontier = np.unique(np.asarray(seeds, dtype=np.int32))
+        mask[frontier] = True
+        while frontier.size:
+            parents = np.concatenate([self.sires[frontier], self.dams[frontier]])
+            parents = parents[parents >= 0]
+            parents = np.unique(parents[~mask[parents]])
+            mask[parents] = True
+            frontier = parents
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def descendant_ids(self, seeds: np.ndarray) -> np.ndarray:
+        """Return sorted ids of the seeds plus every recorded descendant."""
+        mask = np.zeros(self.n_nodes, dtype=bool)
+        frontier = np.unique(np.asarray(seeds, dtype=np.int32))
+        mask[frontier] = True
+        while frontier.size:
+            children = _csr_gather(self.child_ptr, self.child_ids, frontier)
+            children = np.unique(children[~mask[children]])
+            mask[children] = True
+            frontier = children
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def sorted_subpedigree(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Renumber a set of LineName rows for the matrix kernels.
+
+        Returns the ids in topological order plus int64 sire/dam positions within
+        that order. Parents outside the set, parents without a row, and parents
+        that do not precede the child (pedigree cycles) become -1, which is how
+        the dense Henderson kernel treats them.
+        """
+        ids = np.asarray(ids, dtype=np.int32)
+        ids = ids[ids < self.n_lines]
+        ids = ids[np.argsort(self.topo_rank[ids], kind="stable")]
+        n = len(ids)
+        # One extra slot so that a -1 parent id maps to position -1.
+        position = np.full(self.n_nodes + 1, -1, dtype=np.int64)
+        position[ids] = np.arange(n, dtype=np.int64)
+        own = np.arange(n, dtype=np.int64)
+        sire_idxs = position[self.sires[ids]]
+        dam_idxs = position[self.dams[ids]]
+        sire_idxs[sire_idxs >= own] = -1
+        dam_idxs[dam_idxs >= own] = -1
+        return ids, sire_idxs, dam_idxs
+
+
+def pedigree_snapshot_path(path: Path) -> Path:
+    digest = hashlib.sha256(str(Path(path).resolve()).encode("utf-8")).hexdigest()[:12]
+    return PEDIGREE_SNAPSHOT_DIR / f"{Path(path).stem}-{digest}.npz"
+
+
+def file_content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 ** 2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_pedigree_snapshot(path: Path) -> Optional[tuple[pd.DataFrame, pd.DataFrame, PedigreeGraph]]:
+    """
+    Return (df, filtered_df, filtered graph) from path's snapshot, or None if it is stale.
+
+    A matching size and mtime is trusted as is. Otherwise the file is hashed, so
+    a touched or copied but unchanged file still reuses its snapshot.
+    """
+    snapshot = pedigree_snapshot_path(path)
+    try:
+        stat = Path(path).stat()
+        with np.load(snapshot) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            if meta.get("version") != PEDIGREE_SNAPSHOT_VERSION:
+                return None
+            if (meta["size"], meta["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                if meta["size"] != stat.st_size or meta["sha256"] != file_content_hash(path):
+                    return None
+            values = np.array(arrays["values"].tolist() + [""], dtype=object)
+            codes = arrays["codes"]
+            rows = arrays["filtered_rows"]
+            graph = PedigreeGraph.from_arrays(arrays, prefix="graph_")
+    except (OSError, KeyError, ValueError):
+        return None
+
+    source_df = pd.DataFrame({col: values[codes[k]] for k, col in enumerate(REQUIRED_PEDIGREE_COLUMNS)})
+    filtered = source_df.iloc[rows].reset_index(drop=True)
+    if (meta["size"], meta["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        save_pedigree_snapshot(path, source_df, rows, graph)
+    return source_df, filtered, graph
+
+
+def save_pedigree_snapshot(path: Path, source_df: pd.DataFrame, filtered_rows: np.ndarray, graph: PedigreeGraph) -> None:
+    """Write path's snapshot atomically; failures only cost the next startup a rebuild."""
+    stat = Path(path).stat()
+    meta = {"version": PEDIGREE_SNAPSHOT_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_content_hash(path)}
+    codes, values = pd.factorize(pd.concat([source_df[col] for col in REQUIRED_PEDIGREE_COLUMNS], ignore_index=True))
+    snapshot = pedigree_snapshot_path(path)
+    tmp = snapshot.with_name(f".{snapshot.stem}.{os.getpid()}.npz")
+    try:
+        PEDIGREE_SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            tmp,
+            meta=np.array(json.dumps(meta)),
+            values=np.array(values.tolist(), dtype=str),
+            codes=codes.reshape(len(REQUIRED_PEDIGREE_COLUMNS), -1).astype(np.int32),
+            filtered_rows=np.asarray(filtered_rows, dtype=np.int64),
+            **graph.to_arrays(prefix="graph_"),
+        )
+        os.replace(tmp, snapshot)
+    except OSError as exc:
+        print(f"WARNING: Could not write pedigree snapshot: {exc}")
+        tmp.unlink(missing_ok=True)
+
+
+def read_pedigree_snapshot(path: Path) -> tuple[pd.DataFrame, pd.DataFrame, PedigreeGraph]:
+    """(df, filtered_df, filtered graph) for a pedigree file, parsing the text only when its snapshot is stale."""
+    cached = load_pedigree_snapshot(path)
+    if cached is not None:
+        return cached
+    source_df = read_pedigree_file(path)
+    rows = np.flatnonzero(informative_row_mask(source_df).to_numpy()) if not source_df.empty else np.arange(0)
+    filtered = source_df.iloc[rows].reset_index(drop=True)
+    graph = PedigreeGraph.from_dataframe(filtered)
+    save_pedigree_snapshot(path, source_df, rows, graph)
+    return source_df, filtered, graph
+
+
+# Compiled graphs for the active frames, keyed by id() and holding the frame so
+# the id cannot be recycled while the entry lives.
+_graph_cache: dict[int, tuple[pd.DataFrame, PedigreeGraph]] = {}
+
+# Empty until load_startup_pedigrees has run; /ready reports when it has.
+default_df = pd.DataFrame(columns=REQUIRED_PEDIGREE_COLUMNS)
+df = default_df.copy()
+filtered_df = df.copy()
+pedigree_ready = threading.Event()
+startup_stats: dict[str, float] = {}
+
+
+def load_startup_pedigrees() -> None:
+    """Load the default and active pedigrees, index the active one, then mark the app ready."""
+    global default_df, df, filtered_df
+    start_time = time.perf_counter()
+    try:
+        loaded_default, _, _ = read_pedigree_snapshot(DEFAULT_FILE)
+    except Exception as exc:
+        print(f"WARNING: Could not load default pedigree: {exc}")
+        loaded_default = pd.DataFrame(columns=REQUIRED_PEDIGREE_COLUMNS)
+
+    try:
+        active_df, active_filtered, graph = load_current_pedigree()
+    except Exception as exc:
+        print(f"WARNING: Could not load current pedigree: {exc}")
+        active_df = loaded_default.copy()
+        active_filtered = compute_filtered_df(active_df)
+        graph = PedigreeGraph.from_dataframe(active_filtered)
+
+    _graph_cache[id(active_filtered)] = (active_filtered, graph)
+    default_df, df, filtered_df = loaded_default, active_df, active_filtered
+    startup_stats["index_seconds"] = time.perf_counter() - start_time
+    if WARMUP_KERNELS:
+        startup_stats["warmup_seconds"] = warm_up_numba_kernels()
+    pedigree_ready.set()
+
+
+def get_pedigree_graph(source_df=None) -> PedigreeGraph:
+    """
+    Return the compiled graph for source_df (default: the active filtered_df).
+
+    Graphs for the active df/filtered_df are built once and reused; any other
+    frame, such as a pedigree with a temporary progeny row, gets a fresh graph.
+    Passing a PedigreeGraph returns it unchanged.
+    """
+    source_df = filtered_df if source_df is None else source_df
+    if isinstance(source_df, PedigreeGraph):
+        return source_df
+    entry = _graph_cache.get(id(source_df))
+    if entry is not None and entry[0] is source_df:
+        return entry[1]
+    graph = PedigreeGraph.from_dataframe(source_df)
+    if source_df is df or source_df is filtered_df:
+        _graph_cache[id(source_df)] = (source_df, graph)
+    return graph
 
-filtered_df = compute_filtered_df(df)
 
 
 def set_active_dataframe(new_df: pd.DataFrame, persist: bool = False) -> str:
@@ -245,6 +692,8 @@ def set_active_dataframe(new_df: pd.DataFrame, persist: bool = False) -> str:
     global df, filtered_df
     df = normalize_pedigree_df(new_df)
     filtered_df = compute_filtered_df(df)
+    _graph_cache.clear()
+    get_pedigree_graph(filtered_df)
 
     if persist:
         USER_INPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -346,104 +795,88 @@ def normalize_style(*parts: str) -> str:
     return ",".join(bits) if bits else "filled"
 
 
-def build_parent_lookup(source_df: pd.DataFrame) -> dict[str, tuple[Optional[str], Optional[str]]]:
-    lookup: dict[str, tuple[Optional[str], Optional[str]]] = {}
-    for _, row in source_df.iterrows():
-        lookup[str(row["LineName"])] = (
-            clean_parent_value(row.get("MaleParent")),
-            clean_parent_value(row.get("FemaleParent")),
-        )
-    return lookup
-
-
-def build_child_lookup(source_df: pd.DataFrame) -> dict[str, list[str]]:
-    children: dict[str, list[str]] = defaultdict(list)
-    for _, row in source_df.iterrows():
-        child = str(row["LineName"])
-        for parent in (clean_parent_value(row.get("MaleParent")), clean_parent_value(row.get("FemaleParent"))):
-            if parent:
-                children[parent].append(child)
-    return children
-
-
 def find_ancestors(line_name: str, source_df: pd.DataFrame):
     """Return ancestors, parent-child relationships, and generation bins."""
-    parent_lookup = build_parent_lookup(source_df)
-    ancestors: set[str] = set()
+    graph = get_pedigree_graph(source_df)
+    names = graph.names
+    ancestor_ids: set[int] = set()
     relationships: list[tuple[str, str, str]] = []
     generations: dict[int, list[str]] = defaultdict(list)
-    seen_edges: set[tuple[str, str, str]] = set()
-    seen_nodes_at_depth: set[tuple[str, int]] = set()
+    seen_edges: set[tuple[int, int, str]] = set()
+    seen_nodes_at_depth: set[tuple[int, int]] = set()
 
-    queue = deque([(line_name, 0)])
+    root = graph.index.get(line_name)
+    if root is None:
+        generations[0].append(line_name)
+        return set(), relationships, generations
+
+    queue = deque([(root, 0)])
     while queue:
         child, depth = queue.popleft()
         if (child, depth) not in seen_nodes_at_depth:
-            generations[depth].append(child)
+            generations[depth].append(names[child])
             seen_nodes_at_depth.add((child, depth))
 
-        if child not in parent_lookup:
-            continue
-
-        male_parent, female_parent = parent_lookup[child]
-        for parent, role in [(male_parent, "male"), (female_parent, "female")]:
-            if not parent:
+        for parent, role in ((int(graph.sires[child]), "male"), (int(graph.dams[child]), "female")):
+            if parent < 0:
                 continue
             edge = (parent, child, role)
             if edge not in seen_edges:
-                relationships.append(edge)
+                relationships.append((names[parent], names[child], role))
                 seen_edges.add(edge)
-            if parent not in ancestors:
-                ancestors.add(parent)
+            if parent not in ancestor_ids:
+                ancestor_ids.add(parent)
                 queue.append((parent, depth + 1))
 
-    return ancestors, relationships, generations
+    return {names[i] for i in ancestor_ids}, relationships, generations
 
 
 def find_descendants(line_name: str, source_df: pd.DataFrame):
     """Return descendants, parent-child relationships, and generation bins."""
-    child_lookup = build_child_lookup(source_df)
-    parent_lookup = build_parent_lookup(source_df)
-    descendants: set[str] = set()
+    graph = get_pedigree_graph(source_df)
+    names = graph.names
+    descendant_ids: set[int] = set()
     relationships: list[tuple[str, str, str]] = []
     generations: dict[int, list[str]] = defaultdict(list)
-    seen_edges: set[tuple[str, str, str]] = set()
+    seen_edges: set[tuple[int, int, str]] = set()
 
-    queue = deque([(line_name, 0)])
-    visited = {line_name}
+    root = graph.index.get(line_name)
+    if root is None:
+        generations[0].append(line_name)
+        return set(), relationships, generations
+
+    queue = deque([(root, 0)])
+    visited = {root}
     while queue:
         parent, depth = queue.popleft()
-        generations[depth].append(parent)
-        for child in child_lookup.get(parent, []):
-            male_parent, female_parent = parent_lookup.get(child, (None, None))
-            role = "male" if male_parent == parent else "female" if female_parent == parent else "descendant"
+        generations[depth].append(names[parent])
+        for child in graph.children_of(parent).tolist():
+            role = "male" if graph.sires[child] == parent else "female" if graph.dams[child] == parent else "descendant"
             edge = (parent, child, role)
             if edge not in seen_edges:
-                relationships.append(edge)
+                relationships.append((names[parent], names[child], role))
                 seen_edges.add(edge)
             if child not in visited:
                 visited.add(child)
-                descendants.add(child)
+                descendant_ids.add(child)
                 queue.append((child, depth + 1))
 
-    return descendants, relationships, generations
+    return {names[i] for i in descendant_ids}, relationships, generations
 
 
 def get_direct_line(line_name: str, source_df: pd.DataFrame, parent_col: str) -> set[str]:
     """Follow the same-sex parental chain for lineage highlighting."""
-    lookup = source_df.set_index("LineName", drop=False)
-    current = line_name
-    collected: set[str] = set()
-    while current in lookup.index:
-        row = lookup.loc[current]
-        if isinstance(row, pd.DataFrame):
-            row = row.iloc[0]
-        parent = clean_parent_value(row.get(parent_col))
-        if not parent or parent in collected:
+    graph = get_pedigree_graph(source_df)
+    parent_ids = graph.parent_ids(parent_col)
+    current = graph.index.get(line_name)
+    collected: set[int] = set()
+    while current is not None and current < graph.n_lines:
+        parent = int(parent_ids[current])
+        if parent < 0 or parent in collected:
             break
         collected.add(parent)
         current = parent
-    return collected
+    return {graph.names[i] for i in collected}
 
 
 def parse_user_genotype_list(text: str) -> list[str]:
@@ -470,12 +903,13 @@ def trace_direct_ancestor_chain(line_name: str, source_df: pd.DataFrame, parent_
     FemaleParent:
         genotype -> FemaleParent -> FemaleParent -> FemaleParent ... oldest direct female ancestor
     """
-    lookup = source_df.set_index("LineName", drop=False)
+    graph = get_pedigree_graph(source_df)
+    parent_ids = graph.parent_ids(parent_col)
     current = str(line_name).strip()
     path = [current]
     visited = {current}
 
-    if current not in lookup.index:
+    if not graph.has_line(current):
         return {
             "OldestAncestor": "",
             "Depth": 0,
@@ -486,17 +920,13 @@ def trace_direct_ancestor_chain(line_name: str, source_df: pd.DataFrame, parent_
     status = "Reached recorded founder / missing parent"
 
     while True:
-        row = lookup.loc[current]
-
-        if isinstance(row, pd.DataFrame):
-            row = row.iloc[0]
+        parent_id = int(parent_ids[graph.index[current]])
 
-        parent = clean_parent_value(row.get(parent_col))
-
-        if not parent:
+        if parent_id < 0:
             status = "Reached recorded founder / missing parent"
             break
 
+        parent = graph.names[parent_id]
         if parent in visited:
             path.append(parent)
             status = "Stopped at cycle"
@@ -505,7 +935,7 @@ def trace_direct_ancestor_chain(line_name: str, source_df: pd.DataFrame, parent_
         path.append(parent)
         visited.add(parent)
 
-        if parent not in lookup.index:
+        if parent_id >= graph.n_lines:
             status = "Stopped at referenced ancestor not present as a LineName row"
             break
 
@@ -536,14 +966,14 @@ def direct_line_ancestor_table(genotypes: list[str], source_df: pd.DataFrame) ->
 
     It does NOT return every terminal ancestor from every branch.
     """
-    available = set(source_df["LineName"].astype(str).tolist())
+    graph = get_pedigree_graph(source_df)
     rows = []
 
     for genotype in genotypes:
         genotype = str(genotype).strip()
 
-        female = trace_direct_ancestor_chain(genotype, source_df, "FemaleParent")
-        male = trace_direct_ancestor_chain(genotype, source_df, "MaleParent")
+        female = trace_direct_ancestor_chain(genotype, graph, "FemaleParent")
+        male = trace_direct_ancestor_chain(genotype, graph, "MaleParent")
 
         # Handles either key name, depending on which trace function version is in your file.
         female_ancestor = female.get("FurthestAncestor", female.get("OldestAncestor", ""))
@@ -552,7 +982,7 @@ def direct_line_ancestor_table(genotypes: list[str], source_df: pd.DataFrame) ->
         rows.append(
             {
                 "Genotype": genotype,
-                "FoundInPedigree": genotype in available,
+                "FoundInPedigree": graph.has_line(genotype),
 
                 "FurthestDirectFemaleAncestor": female_ancestor,
                 "DirectFemaleDepth": female.get("Depth", 0),
@@ -581,8 +1011,7 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
     checks than a very wide table with an unknown number of terminals.
     """
     max_depth = int(max(1, min(max_depth or 12, 30)))
-    parent_lookup = build_parent_lookup(source_df)
-    available = set(source_df["LineName"].astype(str).tolist())
+    graph = get_pedigree_graph(source_df)
     branch_specs = [
         ("MaleParent", "Male branch from input", 0),
         ("FemaleParent", "Female branch from input", 1),
@@ -610,7 +1039,7 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
                 "BranchParentColumn": branch_col,
                 "StartingParent": starting_parent or "",
                 "TerminalAncestor": terminal,
-                "TerminalAncestorFoundAsLineName": bool(terminal in available) if terminal else False,
+                "TerminalAncestorFoundAsLineName": graph.has_line(terminal) if terminal else False,
                 "TerminalDepthFromInput": int(depth),
                 "TerminalReachedThroughParentSlot": path_slots[-1] if path_slots else "",
                 "AllMaleParentPath": bool(path_slots) and all(slot == "MaleParent" for slot in path_slots),
@@ -624,7 +1053,7 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
 
     for raw_genotype in genotypes:
         genotype = str(raw_genotype).strip()
-        found = genotype in available
+        found = graph.has_line(genotype)
         if not found:
             for branch_col, branch_label, _ in branch_specs:
                 add_terminal_row(
@@ -641,7 +1070,7 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
                 )
             continue
 
-        male_parent, female_parent = parent_lookup.get(genotype, (None, None))
+        male_parent, female_parent = graph.parents(genotype)
         start_parents = {"MaleParent": male_parent, "FemaleParent": female_parent}
 
         for branch_col, branch_label, _ in branch_specs:
@@ -686,7 +1115,7 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
                     )
                     continue
 
-                if current not in available:
+                if not graph.has_line(current):
                     add_terminal_row(
                         genotype=genotype,
                         found=True,
@@ -701,7 +1130,7 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
                     )
                     continue
 
-                current_male, current_female = parent_lookup.get(current, (None, None))
+                current_male, current_female = graph.parents(current)
                 next_parents = [("FemaleParent", current_female), ("MaleParent", current_male)]
                 valid_next = [(slot, parent) for slot, parent in next_parents if parent]
 
@@ -771,17 +1200,21 @@ def terminal_branch_ancestor_table(genotypes: list[str], source_df: pd.DataFrame
     return pd.DataFrame(rows, columns=columns)
 
 def collect_selected_only(selected_lines: Iterable[str], source_df: pd.DataFrame) -> set[str]:
-    valid = set(source_df["LineName"].astype(str).tolist())
-    return {line for line in selected_lines if line in valid}
+    graph = get_pedigree_graph(source_df)
+    return {line for line in selected_lines if graph.has_line(line)}
 
 
 def collect_lines_with_ancestors(selected_lines: Iterable[str], source_df: pd.DataFrame) -> set[str]:
-    selected = collect_selected_only(selected_lines, source_df)
-    all_lines = set(selected)
-    for line in selected:
-        ancestors, _, _ = find_ancestors(line, source_df)
-        all_lines.update(ancestors)
-    return all_lines
+    graph = get_pedigree_graph(source_df)
+    seeds = graph.ids(collect_selected_only(selected_lines, graph))
+    return {graph.names[i] for i in graph.ancestor_ids(seeds).tolist()}
+
+
+def collect_lines_with_ancestors_and_descendants(selected_lines: Iterable[str], source_df: pd.DataFrame) -> set[str]:
+    graph = get_pedigree_graph(source_df)
+    seeds = graph.ids(collect_selected_only(selected_lines, graph))
+    related = np.union1d(graph.ancestor_ids(seeds), graph.descendant_ids(seeds))
+    return {graph.names[i] for i in related.tolist()}
 
 
 
@@ -1000,7 +1433,7 @@ def compute_ancestor_contributions(line_name: str, source_df: pd.DataFrame, max_
     Each parent receives half of the current contribution recursively. Duplicate
     appearances through multiple paths are accumulated.
     """
-    parent_lookup = build_parent_lookup(source_df)
+    graph = get_pedigree_graph(source_df)
     contributions: dict[str, float] = defaultdict(float)
     path_counts: dict[str, int] = defaultdict(int)
     queue = deque([(line_name, 1.0, 0)])
@@ -1010,19 +1443,19 @@ def compute_ancestor_contributions(line_name: str, source_df: pd.DataFrame, max_
         child, weight, depth = queue.popleft()
         if depth >= max_depth:
             continue
-        male_parent, female_parent = parent_lookup.get(child, (None, None))
+        male_parent, female_parent = graph.parents(child)
         for parent in (female_parent, male_parent):
             if not parent:
                 continue
             child_weight = weight * 0.5
             contributions[parent] += child_weight
             path_counts[parent] += 1
-            if parent in parent_lookup:
+            if graph.has_line(parent):
                 queue.append((parent, child_weight, depth + 1))
 
     records = []
     for ancestor, contrib in contributions.items():
-        male_parent, female_parent = parent_lookup.get(ancestor, (None, None))
+        male_parent, female_parent = graph.parents(ancestor)
         is_founder = not male_parent and not female_parent
         records.append(
             {
@@ -1039,7 +1472,7 @@ def compute_ancestor_contributions(line_name: str, source_df: pd.DataFrame, max_
 
 
 def collect_founders_for_line(line_name: str, source_df: pd.DataFrame, max_depth: int = 12) -> set[str]:
-    parent_lookup = build_parent_lookup(source_df)
+    graph = get_pedigree_graph(source_df)
     founders: set[str] = set()
     queue = deque([(line_name, 0)])
     visited_paths = 0
@@ -1048,12 +1481,12 @@ def collect_founders_for_line(line_name: str, source_df: pd.DataFrame, max_depth
         node, depth = queue.popleft()
         if depth >= max_depth:
             continue
-        male_parent, female_parent = parent_lookup.get(node, (None, None))
+        male_parent, female_parent = graph.parents(node)
         parents = [p for p in (male_parent, female_parent) if p]
         if not parents and node != line_name:
             founders.add(node)
         for parent in parents:
-            pm, pf = parent_lookup.get(parent, (None, None))
+            pm, pf = graph.parents(parent)
             if not pm and not pf:
                 founders.add(parent)
             else:
@@ -1176,7 +1609,7 @@ def build_pedigree_fan_rows(selected_line: str, source_df: pd.DataFrame, max_dep
     what pedigree wheels/fan charts need.
     """
     max_depth = int(max(1, min(max_depth or 5, 12)))
-    parent_lookup = build_parent_lookup(source_df)
+    graph = get_pedigree_graph(source_df)
 
     rows: list[dict] = []
     queue = deque()
@@ -1208,7 +1641,7 @@ def build_pedigree_fan_rows(selected_line: str, source_df: pd.DataFrame, max_dep
         if gen >= max_depth:
             continue
 
-        male_parent, female_parent = parent_lookup.get(line, (None, None))
+        male_parent, female_parent = graph.parents(line)
         role_to_parent = {"male": male_parent, "female": female_parent}
 
         for role, short_role, role_label, branch_label in role_specs:
@@ -1463,10 +1896,10 @@ def generation_ring_figure(selected_line: str, max_depth: int, style: str = "fan
 
 def cytoscape_elements_for_line(selected_line: str, max_depth: int):
     nodes, edges, generations = build_ancestor_subgraph(selected_line, filtered_df, max_depth)
-    parent_lookup = build_parent_lookup(filtered_df)
+    graph = get_pedigree_graph(filtered_df)
     elements = []
     for node in sorted(nodes):
-        male_parent, female_parent = parent_lookup.get(node, (None, None))
+        male_parent, female_parent = graph.parents(node)
         generation = None
         for gen, names in generations.items():
             if node in names:
@@ -1502,87 +1935,736 @@ def sort_pedigree_df(pedigree_df: pd.DataFrame) -> pd.DataFrame:
         return pedigree_df.copy()
 
     work = normalize_pedigree_df(pedigree_df)
-    line_set = set(work["LineName"])
-    children: dict[str, list[str]] = defaultdict(list)
-    indegree: dict[str, int] = {line: 0 for line in work["LineName"]}
+    graph = PedigreeGraph.from_dataframe(work)
+    if graph.n_unresolved:
+        remaining = [graph.names[i] for i in graph.topo_order[-graph.n_unresolved:].tolist()]
+        print("WARNING: Cycles or unresolved ordering detected. Appending remaining lines:", remaining)
 
-    for _, row in work.iterrows():
-        child = row["LineName"]
-        for parent in (clean_parent_value(row["MaleParent"]), clean_parent_value(row["FemaleParent"])):
-            if parent and parent in line_set:
-                children[parent].append(child)
-                indegree[child] += 1
+    return work.iloc[graph.topo_order].reset_index(drop=True)
 
-    queue = deque([line for line in work["LineName"] if indegree[line] == 0])
-    sorted_lines: list[str] = []
-    visited: set[str] = set()
 
-    while queue:
-        line = queue.popleft()
-        if line in visited:
-            continue
-        visited.add(line)
-        sorted_lines.append(line)
-        for child in children.get(line, []):
-            indegree[child] -= 1
-            if indegree[child] == 0:
-                queue.append(child)
+@njit(cache=True, nogil=True)
+def _heap_push(heap, size, value):
+    heap[size] = value
+    child = size
+    while child > 0:
+        parent = (child - 1) // 2
+        if heap[parent] >= heap[child]:
+            break
+        heap[parent], heap[child] = heap[child], heap[parent]
+        child = parent
+    return size + 1
 
-    remaining = [line for line in work["LineName"] if line not in visited]
-    if remaining:
-        print("WARNING: Cycles or unresolved ordering detected. Appending remaining lines:", remaining)
-        sorted_lines.extend(remaining)
 
-    return work.set_index("LineName").loc[sorted_lines].reset_index()
+@njit(cache=True, nogil=True)
+def _heap_pop(heap, size):
+    top = heap[0]
+    size -= 1
+    heap[0] = heap[size]
+    parent = 0
+    while True:
+        left = 2 * parent + 1
+        if left >= size:
+            break
+        child = left
+        if left + 1 < size and heap[left + 1] > heap[left]:
+            child = left + 1
+        if heap[parent] >= heap[child]:
+            break
+        heap[parent], heap[child] = heap[child], heap[parent]
+        parent = child
+    return top, size
+
 
+@njit(cache=True, nogil=True)
+def _inbreeding_numba(sire_idxs, dam_idxs):
+    """
+    Meuwissen & Luo (1992) inbreeding for a sorted pedigree.
 
-@njit
-def _build_matrix_numba(n, sire_idxs, dam_idxs):
-    A = np.zeros((n, n), dtype=np.float64)
+    Returns F and the Mendelian-sampling variances D (the diagonal of A = T D T').
+    Ancestors are visited youngest-first through a max-heap of positions, so
+    memory stays O(n).
+    """
+    n = sire_idxs.shape[0]
+    F = np.zeros(n)
+    D = np.ones(n)
+    L = np.zeros(n)
+    heap = np.empty(n, dtype=np.int64)
+    queued = np.zeros(n, dtype=np.bool_)
     for i in range(n):
-        s_i = sire_idxs[i]
-        d_i = dam_idxs[i]
-        if s_i == -1 and d_i == -1:
-            A[i, i] = 1.0
-        elif s_i != -1 and d_i == -1:
-            A[i, i] = 1.0
-            A[i, :i] = 0.5 * A[s_i, :i]
-            A[:i, i] = A[i, :i]
-        elif s_i == -1 and d_i != -1:
-            A[i, i] = 1.0
-            A[i, :i] = 0.5 * A[d_i, :i]
-            A[:i, i] = A[i, :i]
-        else:
-            A[i, i] = 1.0 + 0.5 * A[s_i, d_i]
-            temp = 0.5 * (A[s_i, :i] + A[d_i, :i])
-            A[i, :i] = temp
-            A[:i, i] = temp
-    return A
+        s = sire_idxs[i]
+        d = dam_idxs[i]
+        fs = F[s] if s >= 0 else -1.0
+        fd = F[d] if d >= 0 else -1.0
+        D[i] = 0.5 - 0.25 * (fs + fd)
+        if s < 0 or d < 0:
+            continue
+        if i > 0 and s == sire_idxs[i - 1] and d == dam_idxs[i - 1]:
+            F[i] = F[i - 1]
+            continue
+        fi = -1.0
+        L[i] = 1.0
+        size = _heap_push(heap, 0, i)
+        queued[i] = True
+        while size > 0:
+            j, size = _heap_pop(heap, size)
+            queued[j] = False
+            lj = L[j]
+            L[j] = 0.0
+            fi += lj * lj * D[j]
+            for p in (sire_idxs[j], dam_idxs[j]):
+                if p >= 0:
+                    L[p] += 0.5 * lj
+                    if not queued[p]:
+                        queued[p] = True
+                        size = _heap_push(heap, size, p)
+        F[i] = fi
+    return F, D
+
+
+@njit(cache=True, nogil=True)
+def _colleau_numba(sire_idxs, dam_idxs, D, X):
+    """Overwrite X with A @ X using A = T D T' (Colleau 2002), never forming A."""
+    n, b = X.shape
+    for i in range(n - 1, -1, -1):
+        s = sire_idxs[i]
+        d = dam_idxs[i]
+        for k in range(b):
+            half = 0.5 * X[i, k]
+            if s >= 0:
+                X[s, k] += half
+            if d >= 0:
+                X[d, k] += half
+    for i in range(n):
+        s = sire_idxs[i]
+        d = dam_idxs[i]
+        for k in range(b):
+            value = D[i] * X[i, k]
+            if s >= 0:
+                value += 0.5 * X[s, k]
+            if d >= 0:
+                value += 0.5 * X[d, k]
+            X[i, k] = value
+    return X
+
+
+@njit(cache=True, nogil=True)
+def _packed_get(values, i, j):
+    if i < j:
+        i, j = j, i
+    return values[i * (i + 1) // 2 + j]
+
+
+@njit(cache=True, nogil=True)
+def _build_packed_numba(sire_idxs, dam_idxs, values, base=1.0, start=0):
+    """
+    Henderson recursion writing only the lower triangle, row by row, into values.
+
+    Rows before start are taken as already filled, which lets a matrix grow by
+    appended lines. base is the founder diagonal: 1 for A, 0.5 for co-ancestry,
+    where the off-diagonal recursion is the same.
+    """
+    n = sire_idxs.shape[0]
+    for i in range(start, n):
+        s = sire_idxs[i]
+        d = dam_idxs[i]
+        row = i * (i + 1) // 2
+        if s >= 0 or d >= 0:
+            for j in range(i):
+                value = 0.0
+                if s >= 0:
+                    value += _packed_get(values, s, j)
+                if d >= 0:
+                    value += _packed_get(values, d, j)
+                values[row + j] = 0.5 * value
+        values[row + i] = base + 0.5 * _packed_get(values, s, d) if s >= 0 and d >= 0 else base
+    return values
+
+
+@njit(cache=True, nogil=True)
+def _generation_layers_numba(sire_idxs, dam_idxs, start=0):
+    """
+    Group a sorted pedigree into generations (founders are 0, others one more than
+    their latest parent). Returns positions ordered by generation plus layer
+    boundaries in that ordering.
+
+    Rows before start, already filled, all form generation 0 and the rows after
+    them start at generation 1.
+    """
+    n = sire_idxs.shape[0]
+    generation = np.zeros(n, dtype=np.int64)
+    for i in range(start, n):
+        s = sire_idxs[i]
+        d = dam_idxs[i]
+        if start > 0:
+            generation[i] = 1
+        if s >= 0 and generation[s] + 1 > generation[i]:
+            generation[i] = generation[s] + 1
+        if d >= 0 and generation[d] + 1 > generation[i]:
+            generation[i] = generation[d] + 1
+    by_generation = np.argsort(generation, kind="mergesort")
+    n_layers = generation.max() + 1 if n else 0
+    layer_ptr = np.zeros(n_layers + 1, dtype=np.int64)
+    for i in range(n):
+        layer_ptr[generation[i] + 1] += 1
+    for g in range(n_layers):
+        layer_ptr[g + 1] += layer_ptr[g]
+    return by_generation, layer_ptr
 
 
-def compute_amatrix_diploid(pedigree_df: pd.DataFrame) -> pd.DataFrame:
-    sorted_df = sort_pedigree_df(pedigree_df)
-    individuals = sorted_df["LineName"].tolist()
-    idx_map = {ind: i for i, ind in enumerate(individuals)}
-    n = len(individuals)
+@njit(cache=True, nogil=True)
+def _parent_mean(values, s, d, j):
+    value = 0.0
+    if s >= 0:
+        value += _packed_get(values, s, j)
+    if d >= 0:
+        value += _packed_get(values, d, j)
+    return 0.5 * value
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _build_packed_layers_numba(sire_idxs, dam_idxs, by_generation, layer_ptr, values, base=1.0, first_layer=0):
+    """
+    Parallel Henderson recursion over generation layers, same packed layout.
+
+    Rows in one generation only depend on earlier generations. For each layer the
+    entries against earlier layers (and the diagonal) are filled in parallel, then
+    the pairs inside the layer, which only read entries from the first phase.
+    Each entry is written once, by the younger of its two lines. Layers before
+    first_layer are taken as already filled.
+    """
+    for layer in range(first_layer, layer_ptr.shape[0] - 1):
+        lo = layer_ptr[layer]
+        hi = layer_ptr[layer + 1]
+        for a in prange(lo, hi):
+            i = by_generation[a]
+            s = sire_idxs[i]
+            d = dam_idxs[i]
+            for k in range(lo):
+                j = by_generation[k]
+                r, c = (i, j) if i > j else (j, i)
+                values[r * (r + 1) // 2 + c] = _parent_mean(values, s, d, j)
+            values[i * (i + 1) // 2 + i] = base + 0.5 * _packed_get(values, s, d) if s >= 0 and d >= 0 else base
+        for a in prange(lo, hi):
+            i = by_generation[a]
+            s = sire_idxs[i]
+            d = dam_idxs[i]
+            if s < 0 and d < 0:
+                continue
+            for b in range(lo, a):
+                j = by_generation[b]
+                r, c = (i, j) if i > j else (j, i)
+                values[r * (r + 1) // 2 + c] = _parent_mean(values, s, d, j)
+    return values
+
+
+@njit(cache=True, nogil=True)
+def _packed_take_numba(values, rows, cols):
+    out = np.empty((rows.shape[0], cols.shape[0]), dtype=values.dtype)
+    for a in range(rows.shape[0]):
+        for b in range(cols.shape[0]):
+            out[a, b] = _packed_get(values, rows[a], cols[b])
+    return out
+
+
+def _array(dtype, ndim: int = 1, readonly: bool = False) -> types.Array:
+    return types.Array(dtype, ndim, "C", readonly=readonly)
+
+
+# Argument types each kernel is called with from Python. Helpers such as
+# _packed_get and the heap are compiled into their callers. Other types, e.g.
+# strided views, still compile lazily on first use.
+_INDEX = _array(types.int64)
+NUMBA_KERNEL_SIGNATURES = [
+    (_inbreeding_numba, [(_INDEX, _INDEX)]),
+    (_colleau_numba, [(_INDEX, _INDEX, _array(types.float64), _array(types.float64, 2))]),
+    (_topological_order_numba, [(_array(types.int32), _array(types.int32), _INDEX, types.int64)]),
+    (_generation_layers_numba, [(_INDEX, _INDEX, types.int64)]),
+    (
+        _build_packed_numba,
+        [(_INDEX, _INDEX, _array(dtype), types.float64, types.int64) for dtype in (types.float32, types.float64)],
+    ),
+    (
+        _build_packed_layers_numba,
+        [(_INDEX, _INDEX, _INDEX, _INDEX, _array(dtype), types.float64, types.int64) for dtype in (types.float32, types.float64)],
+    ),
+    # Stored matrices are read-only memmaps.
+    (
+        _packed_take_numba,
+        [(_array(dtype, readonly=ro), _INDEX, _INDEX) for dtype in (types.float32, types.float64) for ro in (False, True)],
+    ),
+]
+
+
+def warm_up_numba_kernels() -> float:
+    """
+    Compile every kernel for its NUMBA_KERNEL_SIGNATURES ahead of the first request.
+
+    Kernels use cache=True, so after the first run this only loads machine code
+    from numba's on-disk cache. Returns the seconds spent.
+    """
+    start_time = time.perf_counter()
+    for kernel, signatures in NUMBA_KERNEL_SIGNATURES:
+        for signature in signatures:
+            kernel.compile(signature)
+    return time.perf_counter() - start_time
+
+
+@dataclass
+class PackedSymmetricMatrix:
+    """
+    Symmetric matrix holding only its lower triangle, packed row by row.
+
+    Entry (i, j) with j <= i lives at ``i * (i + 1) // 2 + j``; read column-wise,
+    the same buffer is the packed upper triangle. This halves memory, and float32
+    halves it again. Dense views are built on request, for a block of rows or
+    for a subset of lines, so the UI never needs the whole square.
+    """
+
+    lines: list[str]
+    values: np.ndarray
+
+    @classmethod
+    def empty(cls, lines: list[str], dtype=np.float64) -> "PackedSymmetricMatrix":
+        n = len(lines)
+        return cls(list(lines), np.zeros(n * (n + 1) // 2, dtype=dtype))
+
+    @classmethod
+    def from_dense(cls, lines: list[str], dense: np.ndarray, dtype=np.float64) -> "PackedSymmetricMatrix":
+        rows, cols = np.tril_indices(len(lines))
+        return cls(list(lines), np.ascontiguousarray(dense[rows, cols], dtype=dtype))
+
+    @property
+    def n(self) -> int:
+        return len(self.lines)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.values.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    def scale_(self, factor: float) -> "PackedSymmetricMatrix":
+        """Scale in place (e.g. 0.5 for co-ancestry) without a second copy."""
+        self.values *= factor
+        return self
+
+    def block(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        return _packed_take_numba(self.values, np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+
+    def row_block(self, start: int, stop: int) -> np.ndarray:
+        return self.block(np.arange(start, min(stop, self.n)), np.arange(self.n))
+
+    def subset(self, lines: Iterable[str]) -> pd.DataFrame:
+        position = {name: i for i, name in enumerate(self.lines)}
+        lines = [line for line in dict.fromkeys(lines) if line in position]
+        pos = np.array([position[line] for line in lines], dtype=np.int64)
+        return pd.DataFrame(self.block(pos, pos), index=lines, columns=lines)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.row_block(0, self.n), index=self.lines, columns=self.lines)
+
+
+# Numba's workqueue threading layer cannot run two parallel regions at once, so
+# there large builds take turns; omp and tbb need no lock, nor do serial kernels.
+_parallel_kernel_lock = threading.Lock()
+
+
+def _fill_packed(
+    sire_idxs: np.ndarray, dam_idxs: np.ndarray, values: np.ndarray, base: float = 1.0, start: int = 0
+) -> np.ndarray:
+    """Run the Henderson recursion from row start on, across all numba threads for large matrices."""
+    if get_num_threads() > 1 and len(sire_idxs) >= PARALLEL_MATRIX_MIN_LINES:
+        by_generation, layer_ptr = _generation_layers_numba(sire_idxs, dam_idxs, int(start))
+        with _parallel_kernel_lock if threading_layer() == "workqueue" else nullcontext():
+            return _build_packed_layers_numba(
+                sire_idxs, dam_idxs, by_generation, layer_ptr, values, float(base), int(start > 0)
+            )
+    return _build_packed_numba(sire_idxs, dam_idxs, values, float(base), int(start))
+
 
-    sire_idxs = np.full(n, -1, dtype=np.int64)
-    dam_idxs = np.full(n, -1, dtype=np.int64)
+def compute_packed_matrix(pedigree_df: pd.DataFrame, method_choice: int, dtype=np.float64) -> PackedSymmetricMatrix:
+    """
+    A (method_choice 0) or coancestry matrix for pedigree_df, kept packed.
+
+    The lines are treated as their own pedigree and come out in sort_pedigree_df
+    order. Co-ancestry is scaled in place. Large matrices are built generation
+    by generation across all numba threads.
+    """
+    graph = PedigreeGraph.from_dataframe(normalize_pedigree_df(pedigree_df))
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.topo_order)
+    matrix = PackedSymmetricMatrix.empty([graph.names[i] for i in ids.tolist()], dtype)
+    _fill_packed(sire_idxs, dam_idxs, matrix.values)
+    if method_choice != 0:
+        matrix.scale_(0.5)
+    return matrix
+
+
+def subset_parents(lines: Iterable[str], source_df=None) -> dict[str, tuple[str, str]]:
+    """
+    Parents of each line with lines taken as their own pedigree, in topological order.
+
+    A parent outside the set is "". Two line sets whose shared lines have the
+    same parents here have the same relationships among those lines.
+    """
+    graph = get_pedigree_graph(source_df)
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.ids(line for line in dict.fromkeys(lines) if graph.has_line(line)))
+    names = [graph.names[i] for i in ids.tolist()]
+    name_arr = np.array(names + [""], dtype=object)
+    return dict(zip(names, zip(name_arr[sire_idxs].tolist(), name_arr[dam_idxs].tolist())))
+
+
+def compute_packed_lines(
+    lines: Iterable[str],
+    source_df=None,
+    method_choice: int = 0,
+    dtype=np.float64,
+    previous: Optional[tuple[PackedSymmetricMatrix, dict[str, tuple[str, str]]]] = None,
+) -> tuple[PackedSymmetricMatrix, int]:
+    """
+    Packed matrix for lines treated as their own pedigree, extending previous when possible.
+
+    previous is an earlier matrix for the same method, packed or block-diagonal,
+    with the subset_parents it was computed from. New pedigree rows never change relationships among
+    existing lines, so if previous has the same precision, covers a subset of
+    the lines, and none of its lines has different parents within the new set,
+    only rows for the added lines are computed, at O(added × n). Otherwise the
+    matrix is rebuilt. Returns the matrix and how many of its lines were reused.
+    """
+    graph = get_pedigree_graph(source_df)
+    ids = graph.ids(line for line in dict.fromkeys(lines) if graph.has_line(line))
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(ids)
+    names = [graph.names[i] for i in ids.tolist()]
+    base = 1.0 if method_choice == 0 else 0.5
+
+    if previous is not None:
+        old_matrix, old_parents = previous
+        parents = subset_parents(names, graph)
+        if old_matrix.dtype == np.dtype(dtype) and all(parents.get(line) == old_parents.get(line) for line in old_matrix.lines):
+            old_lines = set(old_matrix.lines)
+            order = old_matrix.lines + [line for line in names if line not in old_lines]
+            position = {line: i for i, line in enumerate(order)}
+            position[""] = -1
+            sire_pos = np.array([position[parents[line][0]] for line in order], dtype=np.int64)
+            dam_pos = np.array([position[parents[line][1]] for line in order], dtype=np.int64)
+            matrix = PackedSymmetricMatrix.empty(order, dtype)
+            fill_packed_triangle(old_matrix, matrix.values[: old_matrix.n * (old_matrix.n + 1) // 2])
+            _fill_packed(sire_pos, dam_pos, matrix.values, base, old_matrix.n)
+            return matrix, old_matrix.n
+
+    matrix = PackedSymmetricMatrix.empty(names, dtype)
+    _fill_packed(sire_idxs, dam_idxs, matrix.values, base)
+    return matrix, 0
+
+
+def split_pedigree_components(
+    lines: Iterable[str], source_df=None, min_lines: int = 1
+) -> list[tuple[list[str], np.ndarray, np.ndarray]]:
+    """
+    Split lines, taken as their own pedigree, into groups with no parent links between them.
+
+    Returns (names, sire_idxs, dam_idxs) per component, each in topological order
+    with parents as positions inside the component, in order of first appearance.
+    Components with fewer than min_lines lines, such as isolated lines, are
+    pooled into one group.
+    """
+    graph = get_pedigree_graph(source_df)
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.ids(line for line in dict.fromkeys(lines) if graph.has_line(line)))
+    n = len(ids)
+    if n == 0:
+        return []
+    from scipy import sparse
+    from scipy.sparse.csgraph import connected_components
+
+    child = np.concatenate([np.flatnonzero(sire_idxs >= 0), np.flatnonzero(dam_idxs >= 0)])
+    parent = np.concatenate([sire_idxs[sire_idxs >= 0], dam_idxs[dam_idxs >= 0]])
+    links = sparse.coo_matrix((np.ones(len(child), dtype=np.int8), (child, parent)), shape=(n, n))
+    _, labels = connected_components(links, directed=False)
+
+    # A stable sort by label keeps each component in topological order.
+    order = np.argsort(labels, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(labels[order]) != 0])
+    groups = np.split(order, starts[1:])
+    small = [members for members in groups if len(members) < min_lines]
+    if len(small) > 1:
+        groups = [members for members in groups if len(members) >= min_lines] + [np.sort(np.concatenate(small))]
+    local = np.full(n + 1, -1, dtype=np.int64)
+    components = []
+    for members in sorted(groups, key=lambda members: members[0]):
+        local[members] = np.arange(len(members))
+        components.append(([graph.names[i] for i in ids[members].tolist()], local[sire_idxs[members]], local[dam_idxs[members]]))
+    return components
+
+
+@dataclass
+class BlockDiagonalMatrix:
+    """
+    Kinship matrix of unrelated groups, kept as one packed block per group.
+
+    Lines are ordered block by block and every entry between blocks is zero, so
+    memory follows the sum of squared block sizes, both in RAM and on disk. It
+    offers the same read methods as PackedSymmetricMatrix; dense rows are only
+    built when asked for.
+    """
+
+    blocks: list[PackedSymmetricMatrix]
+    lines: list[str] = field(init=False)
+    offsets: np.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.lines = [line for blk in self.blocks for line in blk.lines]
+        self.offsets = np.cumsum([0] + [blk.n for blk in self.blocks])
+
+    @classmethod
+    def from_stored(cls, lines: list[str], values: np.ndarray, offsets: np.ndarray) -> "BlockDiagonalMatrix":
+        """Blocks as views into values, the packed blocks stored one after another."""
+        sizes = np.diff(offsets)
+        starts = np.cumsum(np.r_[0, sizes * (sizes + 1) // 2])
+        return cls(
+            [
+                PackedSymmetricMatrix(lines[offsets[b] : offsets[b + 1]], values[starts[b] : starts[b + 1]])
+                for b in range(len(sizes))
+            ]
+        )
+
+    @property
+    def n(self) -> int:
+        return len(self.lines)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.blocks[0].dtype
+
+    @property
+    def nbytes(self) -> int:
+        return sum(blk.nbytes for blk in self.blocks)
+
+    def block(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        out = np.zeros((len(rows), len(cols)), dtype=self.dtype)
+        row_block = np.searchsorted(self.offsets, rows, side="right") - 1
+        col_block = np.searchsorted(self.offsets, cols, side="right") - 1
+        for b in np.intersect1d(row_block, col_block):
+            r = np.flatnonzero(row_block == b)
+            c = np.flatnonzero(col_block == b)
+            out[np.ix_(r, c)] = self.blocks[b].block(rows[r] - self.offsets[b], cols[c] - self.offsets[b])
+        return out
+
+    def row_block(self, start: int, stop: int) -> np.ndarray:
+        return self.block(np.arange(start, min(stop, self.n)), np.arange(self.n))
+
+    def subset(self, lines: Iterable[str]) -> pd.DataFrame:
+        position = {name: i for i, name in enumerate(self.lines)}
+        lines = [line for line in dict.fromkeys(lines) if line in position]
+        pos = np.array([position[line] for line in lines], dtype=np.int64)
+        return pd.DataFrame(self.block(pos, pos), index=lines, columns=lines)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.row_block(0, self.n), index=self.lines, columns=self.lines)
+
+
+def fill_packed_triangle(matrix, out: np.ndarray) -> None:
+    """Write any matrix with row_block() into out as a packed lower triangle, a block of rows at a time."""
+    if isinstance(matrix, PackedSymmetricMatrix):
+        out[:] = matrix.values
+        return
+    n = matrix.n
+    rows_per_chunk = max(1, MATRIX_CSV_CHUNK_BYTES // max(1, 8 * n))
+    for start in range(0, n, rows_per_chunk):
+        stop = min(start + rows_per_chunk, n)
+        dense = matrix.row_block(start, stop)
+        lower = np.arange(n)[None, :] <= np.arange(start, stop)[:, None]
+        out[start * (start + 1) // 2 : stop * (stop + 1) // 2] = dense[lower]
+
+
+def write_packed_matrix(matrix, matrix_path: Path | str) -> None:
+    """Expand any matrix with row_block() into a packed-triangle .npy file."""
+    n = matrix.n
+    out = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=matrix.dtype, shape=(n * (n + 1) // 2,))
+    fill_packed_triangle(matrix, out)
+    out.flush()
+    del out
+
+
+def write_block_matrix(matrix: BlockDiagonalMatrix, matrix_path: Path | str) -> None:
+    """Store the packed blocks one after another, with their line offsets in a .blocks.npy sidecar."""
+    size = sum(blk.values.size for blk in matrix.blocks)
+    out = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=matrix.dtype, shape=(size,))
+    start = 0
+    for blk in matrix.blocks:
+        out[start : start + blk.values.size] = blk.values
+        start += blk.values.size
+    out.flush()
+    del out
+    np.save(matrix_blocks_path(matrix_path), matrix.offsets)
+
+
+def use_block_diagonal(components: list[tuple[list[str], np.ndarray, np.ndarray]], dtype=np.float64) -> bool:
+    """
+    True when storing components as blocks pays off and fits in RAM.
+
+    The zeros between blocks must be at least BLOCK_MIN_SAVING of the packed
+    triangle; below that one packed build is faster than many small ones.
+    """
+    n = sum(len(names) for names, _, _ in components)
+    stored = sum(len(names) * (len(names) + 1) // 2 for names, _, _ in components)
+    return (
+        len(components) > 1
+        and stored <= (1 - BLOCK_MIN_SAVING) * n * (n + 1) // 2
+        and stored * np.dtype(dtype).itemsize <= MATRIX_RAM_BUDGET_BYTES
+    )
+
+
+def compute_block_diagonal_matrix(
+    components: list[tuple[list[str], np.ndarray, np.ndarray]], method_choice: int = 0, dtype=np.float64
+) -> BlockDiagonalMatrix:
+    """Build each component's packed block independently, on a thread pool (the kernel releases the GIL)."""
+    base = 1.0 if method_choice == 0 else 0.5
+    blocks = [PackedSymmetricMatrix.empty(names, dtype) for names, _, _ in components]
+    with ThreadPoolExecutor(max_workers=max(1, get_num_threads())) as pool:
+        # Largest blocks first so one big family does not start last.
+        order = sorted(range(len(blocks)), key=lambda b: -blocks[b].n)
+        futures = [pool.submit(_build_packed_numba, components[b][1], components[b][2], blocks[b].values, base, 0) for b in order]
+        for future in futures:
+            future.result()
+    return BlockDiagonalMatrix(blocks)
 
-    for i, row in sorted_df.iterrows():
-        sire = clean_parent_value(row.get("MaleParent"))
-        dam = clean_parent_value(row.get("FemaleParent"))
-        if sire in idx_map:
-            sire_idxs[i] = idx_map[sire]
-        if dam in idx_map:
-            dam_idxs[i] = idx_map[dam]
 
-    A = _build_matrix_numba(n, sire_idxs, dam_idxs)
-    return pd.DataFrame(A, index=individuals, columns=individuals)
+def full_sib_families(lines: Iterable[str], source_df=None) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Group lines, taken as their own pedigree, into full-sib families.
+
+    Lines sharing both parent positions (at least one known) and with no
+    offspring among the lines have identical kinship rows apart from the
+    diagonal; every other line is a family of its own. Returns the names in
+    topological order, each line's family, and the sire/dam family of each
+    family's first member, so the families form a smaller pedigree.
+    """
+    graph = get_pedigree_graph(source_df)
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.ids(line for line in dict.fromkeys(lines) if graph.has_line(line)))
+    n = len(ids)
+    is_parent = np.zeros(n, dtype=bool)
+    is_parent[sire_idxs[sire_idxs >= 0]] = True
+    is_parent[dam_idxs[dam_idxs >= 0]] = True
+    groupable = ~is_parent & ((sire_idxs >= 0) | (dam_idxs >= 0))
+
+    # Families are keyed by their parents; lines that cannot share a row key on themselves.
+    keys = np.where(groupable, (sire_idxs + 1) * (n + 1) + (dam_idxs + 1), -1 - np.arange(n))
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # Number families in the order of their first member, which keeps parents first.
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+    family = rank[inverse.ravel()]
+    representatives = np.sort(first)
+
+    local = np.append(family, -1)
+    names = [graph.names[i] for i in ids.tolist()]
+    return names, family, local[sire_idxs[representatives]], local[dam_idxs[representatives]]
+
+
+@dataclass
+class FamilyCompressedMatrix:
+    """
+    Kinship matrix with one packed row per full-sib family.
+
+    families holds the kinship between families, with each family's own
+    diagonal as its members' diagonal. Two different members of one family are
+    related by sibs[f]. Entries are looked up through family, so reads behave
+    like PackedSymmetricMatrix and full rows are only expanded on export.
+    """
+
+    lines: list[str]
+    family: np.ndarray
+    families: PackedSymmetricMatrix
+    sibs: np.ndarray
+
+    @classmethod
+    def from_stored(cls, lines: list[str], values: np.ndarray, family: np.ndarray, sibs: np.ndarray) -> "FamilyCompressedMatrix":
+        """Wrap a stored family-level triangle; each family is named after its first member."""
+        _, first = np.unique(family, return_index=True)
+        return cls(lines, family, PackedSymmetricMatrix([lines[i] for i in first.tolist()], values), sibs)
+
+    @property
+    def n(self) -> int:
+        return len(self.lines)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.families.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.families.nbytes + self.family.nbytes + self.sibs.nbytes
+
+    def diagonal(self) -> np.ndarray:
+        fam = np.arange(self.families.n)
+        return self.families.block(fam, fam).diagonal()[self.family]
+
+    def block(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        row_family = self.family[rows]
+        col_family = self.family[cols]
+        out = self.families.block(row_family, col_family)
+        siblings = (row_family[:, None] == col_family[None, :]) & (rows[:, None] != cols[None, :])
+        out[siblings] = self.sibs[np.broadcast_to(row_family[:, None], out.shape)[siblings]]
+        return out
+
+    def row_block(self, start: int, stop: int) -> np.ndarray:
+        return self.block(np.arange(start, min(stop, self.n)), np.arange(self.n))
+
+    def subset(self, lines: Iterable[str]) -> pd.DataFrame:
+        position = {name: i for i, name in enumerate(self.lines)}
+        lines = [line for line in dict.fromkeys(lines) if line in position]
+        pos = np.array([position[line] for line in lines], dtype=np.int64)
+        return pd.DataFrame(self.block(pos, pos), index=lines, columns=lines)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.row_block(0, self.n), index=self.lines, columns=self.lines)
+
+
+def compute_family_compressed_matrix(
+    names: list[str], family: np.ndarray, sire_idxs: np.ndarray, dam_idxs: np.ndarray,
+    method_choice: int = 0, dtype=np.float64,
+) -> FamilyCompressedMatrix:
+    """Build the family-level matrix from full_sib_families output."""
+    n_families = len(sire_idxs)
+    first = np.full(n_families, -1, dtype=np.int64)
+    first[family[::-1]] = np.arange(len(family))[::-1]
+    families = PackedSymmetricMatrix.empty([names[i] for i in first.tolist()], dtype)
+    _fill_packed(sire_idxs, dam_idxs, families.values)
+    if method_choice != 0:
+        families.scale_(0.5)
+
+    # Full sibs: a_ij = (a_ss + a_dd + 2 a_sd) / 4, unknown parents contributing nothing.
+    s = np.maximum(sire_idxs, 0)
+    d = np.maximum(dam_idxs, 0)
+    has_s = sire_idxs >= 0
+    has_d = dam_idxs >= 0
+
+    def entries(i, j):
+        hi, lo = np.maximum(i, j), np.minimum(i, j)
+        return families.values[hi * (hi + 1) // 2 + lo]
+
+    sibs = 0.25 * (has_s * entries(s, s) + has_d * entries(d, d) + 2 * (has_s & has_d) * entries(s, d))
+    return FamilyCompressedMatrix(names, family, families, sibs.astype(dtype))
+
+
+def write_family_matrix(matrix: FamilyCompressedMatrix, matrix_path: Path | str) -> None:
+    """Store the family-level triangle, with each line's family and the sib values in a .families.npz sidecar."""
+    np.save(matrix_path, matrix.families.values)
+    np.savez(matrix_families_path(matrix_path), family=matrix.family, sibs=matrix.sibs)
+
+
+def compute_amatrix_diploid(pedigree_df: pd.DataFrame) -> pd.DataFrame:
+    return compute_packed_matrix(pedigree_df, 0).to_dataframe()
 
 
 def compute_amatrix_coancestry(pedigree_df: pd.DataFrame) -> pd.DataFrame:
-    return compute_amatrix_diploid(pedigree_df) / 2.0
+    return compute_packed_matrix(pedigree_df, 1).to_dataframe()
 
 
 def compute_selected_matrix(pedigree_df: pd.DataFrame, method_choice: int) -> pd.DataFrame:
@@ -1590,93 +2672,934 @@ def compute_selected_matrix(pedigree_df: pd.DataFrame, method_choice: int) -> pd
         return compute_amatrix_diploid(pedigree_df)
     return compute_amatrix_coancestry(pedigree_df)
 
-# =============================================================================
-# Layout
-# =============================================================================
 
-app.layout = html.Div([dcc.Location(id="url", refresh=False), html.Div(id="page-content")])
+def kinship_vector(line_name: str, targets: Iterable[str], source_df=None, method_choice: int = 0) -> pd.Series:
+    """
+    Return one row of the A (or coancestry) matrix, restricted to targets.
 
+    Only the ancestors of the line and the targets are visited: Meuwissen–Luo
+    gives the Mendelian-sampling diagonal and a single Colleau product gives
+    A e_i, so time and memory grow linearly with that ancestor set. Values match
+    compute_packed_matrix over the same lines plus their ancestors; targets
+    that are not pedigree rows get 0.
+    """
+    graph = get_pedigree_graph(source_df)
+    targets = list(dict.fromkeys(targets))
+    values = pd.Series(0.0, index=targets, dtype=float)
+    root = graph.index.get(line_name)
+    if root is None or root >= graph.n_lines:
+        return values
+
+    seeds = np.append(graph.ids(targets), root)
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.ancestor_ids(seeds))
+    _, D = _inbreeding_numba(sire_idxs, dam_idxs)
+    X = np.zeros((len(ids), 1))
+    X[np.flatnonzero(ids == root)[0], 0] = 1.0
+    _colleau_numba(sire_idxs, dam_idxs, D, X)
+
+    scale = 1.0 if method_choice == 0 else 0.5
+    row = dict(zip((graph.names[i] for i in ids.tolist()), (scale * X[:, 0]).tolist()))
+    return pd.Series([row.get(name, 0.0) for name in targets], index=targets, dtype=float)
+
+
+def _colleau_column_batches(sire_idxs: np.ndarray, dam_idxs: np.ndarray, D: np.ndarray, col_pos: np.ndarray):
+    """Yield (start, A[:, col_pos[start:start + b]]) in batches sized by COLLEAU_BATCH_BYTES."""
+    n = len(sire_idxs)
+    batch = int(max(1, min(len(col_pos), COLLEAU_BATCH_BYTES // (8 * n))))
+    for start in range(0, len(col_pos), batch):
+        cols = col_pos[start:start + batch]
+        X = np.zeros((n, len(cols)))
+        X[cols, np.arange(len(cols))] = 1.0
+        yield start, _colleau_numba(sire_idxs, dam_idxs, D, X)
+
+
+def kinship_block(row_lines: Iterable[str], col_lines: Iterable[str], source_df=None, method_choice: int = 0) -> pd.DataFrame:
+    """
+    Return the exact A (or coancestry) block for row_lines × col_lines.
 
-def base_layout(content):
-    return dbc.Container(
-        [
-            dbc.Row(
-                [
-                    dbc.Col(
-                        html.Div(
-                            [
-                                html.Button(
-                                    html.I(className="fas fa-home"),
-                                    id="home-button",
-                                    style=CUSTOM_CSS["round_button"],
-                                ),
-                                html.Button(
-                                    html.I(className="fas fa-table"),
-                                    id="view-data-button",
-                                    style={**CUSTOM_CSS["round_button"], "backgroundColor": "#27ae60"},
-                                ),
-                            ],
-                            style=CUSTOM_CSS["left_button_group"],
-                        ),
-                        width=6,
-                    ),
-                    dbc.Col(
-                        html.Div(
-                            [
-                                html.Button(
-                                    html.I(className="fas fa-trash"),
-                                    id="clear-data-button",
-                                    style={**CUSTOM_CSS["round_button"], "backgroundColor": "#e74c3c"},
-                                ),
-                                html.Button("?", id="open-info-modal", style=CUSTOM_CSS["round_button"]),
-                            ],
-                            style=CUSTOM_CSS["right_button_group"],
-                        ),
-                        width=6,
-                    ),
-                ]
-            ),
-            dbc.Row(
-                dbc.Col(
-                    html.H1("CaneCestry", className="app-header", style={**CUSTOM_CSS["header"], "fontSize": "60px"})
-                )
-            ),
-            dbc.Row(dbc.Col(html.Div(id="common-content", children=content))),
-            dbc.Modal(
-                [
-                    dbc.ModalHeader(dbc.ModalTitle("CaneCestry 2.0 – User Reference")),
-                    dbc.ModalBody(
-                        html.Div(
-                            [
-                                html.H4("Overview"),
-                                html.P(
-                                    "CaneCestry supports pedigree management, pedigree visualization, "
-                                    "ancestry queries, and generation of Henderson A-matrices or coancestry matrices."
-                                ),
-                                html.H4("Matrix Generation"),
-                                html.P(
-                                    "Use one page, one Generate button, and the pedigree-expansion slider to choose "
-                                    "Selected lines only, Selected lines + ancestors, or Selected lines + ancestors + descendants."
-                                ),
-                                html.H4("Pedigree Explorer"),
-                                html.Ul(
-                                    [
-                                        html.Li("Specific pairing lookup."),
-                                        html.Li("Single-parent progeny lookup."),
-                                        html.Li("SVG family trees with generation-depth control."),
-                                        html.Li("Male/female lineage highlighting using blue/red border emphasis."),
-                                        html.Li("Descendant, combined-family, and temporary-progeny trees."),
-                                    ]
-                                ),
-                                html.H4("Add Pedigree Entries"),
-                                html.P(
-                                    "Upload rows with LineName, FemaleParent, and MaleParent. Valid rows are saved, "
-                                    "and rows with unrecognized parents can be corrected before saving."
-                                ),
-                            ],
-                            style={"fontSize": "15px"},
-                        )
-                    ),
+    Relationships are traced through the whole pedigree, but only the requested
+    block is kept: Colleau products are run over the ancestor set in batches of
+    columns sized by COLLEAU_BATCH_BYTES. Names that are not pedigree rows are
+    dropped.
+    """
+    graph = get_pedigree_graph(source_df)
+    row_ids = graph.ids(line for line in dict.fromkeys(row_lines) if graph.has_line(line))
+    col_ids = graph.ids(line for line in dict.fromkeys(col_lines) if graph.has_line(line))
+    row_names = [graph.names[i] for i in row_ids.tolist()]
+    col_names = [graph.names[i] for i in col_ids.tolist()]
+    block = np.zeros((len(row_ids), len(col_ids)))
+    if block.size == 0:
+        return pd.DataFrame(block, index=row_names, columns=col_names)
+
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.ancestor_ids(np.concatenate([row_ids, col_ids])))
+    _, D = _inbreeding_numba(sire_idxs, dam_idxs)
+    position = np.full(graph.n_nodes, -1, dtype=np.int64)
+    position[ids] = np.arange(len(ids))
+    row_pos = position[row_ids]
+
+    for start, X in _colleau_column_batches(sire_idxs, dam_idxs, D, position[col_ids]):
+        block[:, start:start + X.shape[1]] = X[row_pos]
+
+    if method_choice != 0:
+        block *= 0.5
+    return pd.DataFrame(block, index=row_names, columns=col_names)
+
+
+def evaluate_crossing_block(females: Iterable[str], males: Iterable[str], source_df=None) -> pd.DataFrame:
+    """
+    Score every female × male cross by the expected inbreeding of its progeny.
+
+    A progeny's F equals the coancestry of its parents, so the whole block comes
+    from one rectangular coancestry block, which is a small part of the time
+    next to ranking the crosses. Returns one row per cross, from lowest to
+    highest expected F; names that are not pedigree rows are dropped.
+    """
+    graph = get_pedigree_graph(source_df)
+    females = [line for line in dict.fromkeys(females) if graph.has_line(line)]
+    males = [line for line in dict.fromkeys(males) if graph.has_line(line)]
+    block = kinship_block(females, males, graph, method_choice=1).to_numpy()
+
+    order = np.argsort(block, axis=None, kind="stable")
+    female_idx, male_idx = np.unravel_index(order, block.shape)
+    return pd.DataFrame(
+        {
+            "Rank": np.arange(1, len(order) + 1),
+            "FemaleParent": np.array(females, dtype=object)[female_idx],
+            "MaleParent": np.array(males, dtype=object)[male_idx],
+            "ExpectedProgenyF": block.ravel()[order],
+        }
+    )
+
+
+def pedigree_inbreeding(source_df=None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Inbreeding for every LineName row without a dense matrix.
+
+    Runs the Meuwissen–Luo kernel over the whole pedigree in sort_pedigree_df
+    order. Returns (ids, sire_idxs, dam_idxs, F, D) with parents as positions in
+    that order and D the Mendelian-sampling variances; memory is O(n). The result
+    is memoized on the graph.
+    """
+    graph = get_pedigree_graph(source_df)
+    cached = graph.derived.get("inbreeding")
+    if cached is None:
+        ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.topo_order)
+        F, D = _inbreeding_numba(sire_idxs, dam_idxs)
+        cached = graph.derived["inbreeding"] = (ids, sire_idxs, dam_idxs, F, D)
+    return cached
+
+
+def inbreeding_table(source_df=None) -> pd.DataFrame:
+    """One row per line with F and the A-matrix diagonal (1 + F), in dataframe order."""
+    graph = get_pedigree_graph(source_df)
+    ids, _, _, F, _ = pedigree_inbreeding(graph)
+    order = np.argsort(ids)
+    ids = ids[order]
+    # The trailing "" turns a -1 parent id into an empty cell.
+    names = np.array(graph.names + [""], dtype=object)
+    line_names = names[ids]
+    years = [infer_year_from_name(nm) for nm in line_names]
+    return pd.DataFrame(
+        {
+            "LineName": line_names,
+            "FemaleParent": names[graph.dams[ids]],
+            "MaleParent": names[graph.sires[ids]],
+            "Inbreeding": F[order],
+            "Diagonal": 1.0 + F[order],
+            "InferredYear": years,
+            "Era": [decade_label(y) for y in years],
+        }
+    )
+
+
+def relationship_product(weights: pd.Series, source_df=None, method_choice: int = 0) -> pd.Series:
+    """
+    Return A·w for a weight per line, over the whole pedigree, in linear time.
+
+    One Colleau pass over the compiled parent arrays and the Mendelian-sampling
+    diagonal from pedigree_inbreeding; A is never formed. Lines missing from
+    weights weigh 0. The result has one value per LineName row, in dataframe order.
+    """
+    graph = get_pedigree_graph(source_df)
+    ids, sire_idxs, dam_idxs, _, D = pedigree_inbreeding(graph)
+    names = [graph.names[i] for i in ids.tolist()]
+    X = weights.reindex(names).fillna(0.0).to_numpy(dtype=np.float64).reshape(-1, 1).copy()
+    _colleau_numba(sire_idxs, dam_idxs, D, X)
+    if method_choice != 0:
+        X *= 0.5
+    order = np.argsort(ids)
+    return pd.Series(X[order, 0], index=[names[i] for i in order.tolist()], dtype=float)
+
+
+def mean_kinship_table(weights: Optional[dict[str, float]] = None, source_df=None, method_choice: int = 0) -> pd.DataFrame:
+    """
+    Each line's weighted mean relationship to a reference group, A·w with w summing to 1.
+
+    weights maps reference lines to weights; None uses every line with equal
+    weight, i.e. A·1/n. Rank 1 is the line least related to the group.
+    """
+    graph = get_pedigree_graph(source_df)
+    if weights is None:
+        w = pd.Series(1.0, index=[graph.names[i] for i in range(graph.n_lines)])
+    else:
+        w = pd.Series({line: float(value) for line, value in weights.items() if graph.has_line(line)}, dtype=float)
+    total = w.sum()
+    if total == 0:
+        return pd.DataFrame(columns=["Rank", "LineName", "MeanKinship", "InferredYear", "Era"])
+    product = relationship_product(w / total, graph, method_choice)
+    years = [infer_year_from_name(name) for name in product.index]
+    result = pd.DataFrame(
+        {
+            "LineName": product.index,
+            "MeanKinship": product.to_numpy(),
+            "InferredYear": years,
+            "Era": [decade_label(y) for y in years],
+        }
+    ).sort_values("MeanKinship", kind="stable", ignore_index=True)
+    result.insert(0, "Rank", np.arange(1, len(result) + 1))
+    return result
+
+
+def greedy_core_set(candidates: Iterable[str], k: int, source_df=None) -> pd.DataFrame:
+    """
+    Greedily pick k candidates that keep the group's mean coancestry lowest.
+
+    Adding line c to a set S raises the coancestry total by 2·s_c + f_cc, where
+    s_c is c's running coancestry sum to S. Each pick costs one Colleau column
+    product over the candidates' ancestors, which updates every s_c at once; no
+    kinship matrix is formed. Returns one row per pick with the group's mean
+    coancestry after it.
+    """
+    graph = get_pedigree_graph(source_df)
+    cand_ids = graph.ids(line for line in dict.fromkeys(candidates) if graph.has_line(line))
+    k = min(int(k), len(cand_ids))
+    if k <= 0:
+        return pd.DataFrame(columns=["Step", "LineName", "Inbreeding", "CoancestryToSet", "GroupMeanCoancestry"])
+
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(graph.ancestor_ids(cand_ids))
+    F, D = _inbreeding_numba(sire_idxs, dam_idxs)
+    position = np.full(graph.n_nodes, -1, dtype=np.int64)
+    position[ids] = np.arange(len(ids))
+    cand_pos = position[cand_ids]
+    self_coancestry = 0.5 * (1.0 + F[cand_pos])
+
+    running = np.zeros(len(cand_pos))
+    available = np.ones(len(cand_pos), dtype=bool)
+    total = 0.0
+    rows = []
+    X = np.zeros((len(ids), 1))
+    for step in range(1, k + 1):
+        cost = np.where(available, 2.0 * running + self_coancestry, np.inf)
+        pick = int(np.argmin(cost))
+        total += cost[pick]
+        available[pick] = False
+        rows.append((step, graph.names[int(cand_ids[pick])], F[cand_pos[pick]], running[pick] / max(1, step - 1), total / step ** 2))
+
+        X[:] = 0.0
+        X[cand_pos[pick], 0] = 1.0
+        _colleau_numba(sire_idxs, dam_idxs, D, X)
+        running += 0.5 * X[cand_pos, 0]
+    return pd.DataFrame(rows, columns=["Step", "LineName", "Inbreeding", "CoancestryToSet", "GroupMeanCoancestry"])
+
+
+def pairwise_kinship(pairs: Iterable[tuple[str, str]], source_df=None, method_choice: int = 0) -> pd.DataFrame:
+    """
+    Kinship for individual (line, line) pairs from the tabular recursion.
+
+    a(i, i) = 1 + F_i and, with i the younger line, a(i, j) = (a(sire_i, j) +
+    a(dam_i, j)) / 2. Intermediate pairs are kept in an LRU memo on the graph,
+    keyed by a * n + b and bounded by KINSHIP_MEMO_BYTES, and shared by later
+    queries, so each pair only visits the ancestors of its two lines. Lines
+    that are not pedigree rows give NaN.
+    """
+    graph = get_pedigree_graph(source_df)
+    state = graph.derived.get("kinship_memo")
+    if state is None:
+        ids, sire_idxs, dam_idxs, F, _ = pedigree_inbreeding(graph)
+        position = np.full(graph.n_nodes, -1, dtype=np.int64)
+        position[ids] = np.arange(len(ids))
+        # setdefault keeps a single memo, and its lock, if two queries start at once.
+        state = graph.derived.setdefault(
+            "kinship_memo",
+            (threading.Lock(), position, sire_idxs.tolist(), dam_idxs.tolist(), (1.0 + F).tolist(), OrderedDict()),
+        )
+    lock, position, sires, dams, diagonal, memo = state
+    n = len(diagonal)
+    memo_size = KINSHIP_MEMO_BYTES // KINSHIP_MEMO_ENTRY_BYTES
+
+    def kinship(i: int, j: int) -> float:
+        # Pairs computed for this query stay in `pinned` until it is answered, so
+        # LRU eviction cannot drop a value that a pair still on the stack needs.
+        pinned: dict[int, float] = {}
+
+        def known(a: int, b: int) -> Optional[float]:
+            if a < 0 or b < 0:
+                return 0.0
+            if a == b:
+                return diagonal[a]
+            key = a * n + b if a > b else b * n + a
+            value = pinned.get(key)
+            if value is None:
+                value = memo.get(key)
+                if value is not None:
+                    memo.move_to_end(key)
+                    pinned[key] = value
+            return value
+
+        # Explicit stack: pedigrees are far deeper than Python's recursion limit allows.
+        stack = [(i, j) if i > j else (j, i)]
+        while stack:
+            a, b = stack[-1]
+            if known(a, b) is not None:
+                stack.pop()
+                continue
+            halves = [(sires[a], b), (dams[a], b)]
+            missing = [pair for pair in halves if known(*pair) is None]
+            if missing:
+                stack.extend((x, y) if x > y else (y, x) for x, y in missing)
+                continue
+            pinned[a * n + b] = 0.5 * (known(*halves[0]) + known(*halves[1]))
+            stack.pop()
+        value = known(i, j)
+        memo.update(pinned)
+        while len(memo) > memo_size:
+            memo.popitem(last=False)
+        return value
+
+    scale = 1.0 if method_choice == 0 else 0.5
+    rows = []
+    # One lock per graph: queries on other pedigrees are not held up.
+    with lock:
+        for line1, line2 in pairs:
+            node1, node2 = graph.index.get(line1), graph.index.get(line2)
+            i = position[node1] if node1 is not None else -1
+            j = position[node2] if node2 is not None else -1
+            value = scale * kinship(int(i), int(j)) if i >= 0 and j >= 0 else np.nan
+            rows.append((line1, line2, value))
+    return pd.DataFrame(rows, columns=["Line1", "Line2", "Kinship"])
+
+
+def parse_kinship_pairs(text: str) -> list[tuple[str, str]]:
+    """
+    Read "line1|line2" pairs separated by newlines or semicolons.
+
+    Within a pair the names may also be separated by a comma or tab, so two-column
+    CSV/TSV files work as is; a Line1,Line2 header row is skipped.
+    """
+    pairs = []
+    for record in re.split(r"[\n;]+", text or ""):
+        fields = [part.strip().strip('"') for part in re.split(r"[|,\t]", record)]
+        fields = [part for part in fields if part]
+        if len(fields) < 2 or (fields[0].lower(), fields[1].lower()) == ("line1", "line2"):
+            continue
+        pairs.append((fields[0], fields[1]))
+    return pairs
+
+
+def henderson_inverse(sire_idxs: np.ndarray, dam_idxs: np.ndarray, D: np.ndarray) -> sparse.csr_matrix:
+    """
+    A-inverse of a sorted pedigree by Henderson's rules with Quaas' inbreeding.
+
+    Each individual adds (1/D_i) * v v' with v = (1, -1/2, -1/2) on itself and its
+    known parents, so the work is linear in the number of records. Selfs fold
+    both parent terms into one entry when the triplets are summed.
+    """
+    from scipy import sparse
+
+    n = sire_idxs.shape[0]
+    idx = np.column_stack((np.arange(n, dtype=np.int64), sire_idxs, dam_idxs))
+    coef = np.where(idx >= 0, np.array([1.0, -0.5, -0.5]), 0.0)
+    idx = np.where(idx >= 0, idx, 0)
+    b = 1.0 / D
+    rows, cols, vals = [], [], []
+    for a in range(3):
+        for c in range(3):
+            value = b * coef[:, a] * coef[:, c]
+            keep = value != 0.0
+            rows.append(idx[keep, a])
+            cols.append(idx[keep, c])
+            vals.append(value[keep])
+    return sparse.coo_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n)
+    ).tocsr()
+
+
+def amatrix_inverse(source_df=None, method_choice: int = 0) -> tuple[list[str], sparse.csr_matrix]:
+    """
+    Sparse A-inverse for every line, in sort_pedigree_df order.
+
+    Reuses the memoized inbreeding pass for D. With method_choice 1 the inverse of
+    the co-ancestry matrix (A / 2) is returned instead.
+    """
+    graph = get_pedigree_graph(source_df)
+    ids, sire_idxs, dam_idxs, _, D = pedigree_inbreeding(graph)
+    inverse = henderson_inverse(sire_idxs, dam_idxs, D)
+    if method_choice == 1:
+        inverse = inverse * 2.0
+    return [graph.names[i] for i in ids], inverse
+
+
+def sparse_triplets(names: list[str], matrix: sparse.spmatrix) -> pd.DataFrame:
+    """Lower-triangle (row, col, value) triplets with 1-based indices, sorted by row then column."""
+    from scipy import sparse
+
+    lower = sparse.tril(matrix).tocoo()
+    order = np.lexsort((lower.col, lower.row))
+    rows = lower.row[order]
+    cols = lower.col[order]
+    name_arr = np.array(names, dtype=object)
+    return pd.DataFrame(
+        {
+            "Row": rows + 1,
+            "Column": cols + 1,
+            "RowLine": name_arr[rows],
+            "ColumnLine": name_arr[cols],
+            "Value": lower.data[order],
+        }
+    )
+
+
+def compute_exact_selected_matrix(selected_lines: Iterable[str], source_df: pd.DataFrame, method_choice: int) -> pd.DataFrame:
+    """Square matrix for the selected lines only, with ancestor relationships intact."""
+    graph = get_pedigree_graph(source_df)
+    ids = graph.ids(collect_selected_only(selected_lines, graph))
+    ordered = [graph.names[i] for i in ids[np.argsort(graph.topo_rank[ids])].tolist()]
+    return kinship_block(ordered, ordered, graph, method_choice)
+
+
+def matrix_exceeds_ram_budget(n_lines: int, dtype=np.float64) -> bool:
+    """True when even the packed triangle of an n_lines matrix would not fit the RAM budget."""
+    return n_lines * (n_lines + 1) // 2 * np.dtype(dtype).itemsize > MATRIX_RAM_BUDGET_BYTES
+
+
+def matrix_lines_path(matrix_path: Path | str) -> Path:
+    return Path(matrix_path).with_suffix(".lines.txt")
+
+
+def read_matrix_lines(matrix_path: Path | str) -> list[str]:
+    return matrix_line_index(matrix_path)[0]
+
+
+@lru_cache(maxsize=8)
+def _load_line_index(lines_path: str, mtime_ns: int) -> tuple[list[str], dict[str, int]]:
+    names = Path(lines_path).read_text(encoding="utf-8").splitlines()
+    return names, {name: i for i, name in enumerate(names)}
+
+
+def matrix_line_index(matrix_path: Path | str) -> tuple[list[str], dict[str, int]]:
+    """Line names of a stored matrix and their positions, cached per file version."""
+    lines_path = matrix_lines_path(matrix_path)
+    return _load_line_index(str(lines_path), lines_path.stat().st_mtime_ns)
+
+
+def matrix_blocks_path(matrix_path: Path | str) -> Path:
+    return Path(matrix_path).with_suffix(".blocks.npy")
+
+
+def matrix_families_path(matrix_path: Path | str) -> Path:
+    return Path(matrix_path).with_suffix(".families.npz")
+
+
+def open_stored_matrix(matrix_path: Path | str) -> PackedSymmetricMatrix | BlockDiagonalMatrix | FamilyCompressedMatrix:
+    """Memory-map a stored matrix; nothing is read until rows or blocks are requested."""
+    lines = read_matrix_lines(matrix_path)
+    values = np.load(matrix_path, mmap_mode="r")
+    blocks_path = matrix_blocks_path(matrix_path)
+    if blocks_path.exists():
+        return BlockDiagonalMatrix.from_stored(lines, values, np.load(blocks_path))
+    families_path = matrix_families_path(matrix_path)
+    if families_path.exists():
+        with np.load(families_path) as families:
+            return FamilyCompressedMatrix.from_stored(lines, values, families["family"], families["sibs"])
+    return PackedSymmetricMatrix(lines, values)
+
+
+def write_matrix_lines(matrix_path: Path | str, names: list[str]) -> None:
+    matrix_lines_path(matrix_path).write_text("\n".join(names) + "\n", encoding="utf-8")
+
+
+def matrix_parents_path(matrix_path: Path | str) -> Path:
+    return Path(matrix_path).with_suffix(".parents.tsv")
+
+
+def write_matrix_parents(matrix_path: Path | str, parents: dict[str, tuple[str, str]]) -> None:
+    """Save subset_parents of a stored matrix, so a later request can extend it."""
+    rows = [f"{line}\t{sire}\t{dam}" for line, (sire, dam) in parents.items()]
+    matrix_parents_path(matrix_path).write_text("\n".join(rows) + "\n", encoding="utf-8")
+
+
+def read_matrix_parents(matrix_path: Path | str) -> dict[str, tuple[str, str]]:
+    rows = matrix_parents_path(matrix_path).read_text(encoding="utf-8").splitlines()
+    return {line: (sire, dam) for line, sire, dam in (row.split("\t") for row in rows)}
+
+
+def write_kinship_memmap(
+    matrix_path: Path | str,
+    lines: Iterable[str],
+    source_df=None,
+    method_choice: int = 0,
+    trace_ancestors: bool = False,
+    dtype=np.float64,
+) -> list[str]:
+    """
+    Stream an A (or coancestry) matrix to a packed .npy file without holding it in RAM.
+
+    Each batch of Colleau columns is, by symmetry, a block of rows, and is
+    written to its contiguous stretch of the packed lower triangle, so peak
+    memory is one batch. Without trace_ancestors the lines
+    form their own pedigree, as in compute_packed_matrix; with it relationships
+    run through all ancestors, as in compute_exact_selected_matrix. Lines are
+    stored in topological order, and the names go to a .lines.txt sidecar.
+    Returns the line order.
+    """
+    graph = get_pedigree_graph(source_df)
+    keep_ids = graph.ids(line for line in dict.fromkeys(lines) if graph.has_line(line))
+    trace_ids = graph.ancestor_ids(keep_ids) if trace_ancestors else keep_ids
+    ids, sire_idxs, dam_idxs = graph.sorted_subpedigree(trace_ids)
+    _, D = _inbreeding_numba(sire_idxs, dam_idxs)
+    keep_pos = np.flatnonzero(np.isin(ids, keep_ids))
+    names = [graph.names[i] for i in ids[keep_pos].tolist()]
+    scale = 1.0 if method_choice == 0 else 0.5
+
+    n = len(names)
+    matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=dtype, shape=(n * (n + 1) // 2,))
+    for start, X in _colleau_column_batches(sire_idxs, dam_idxs, D, keep_pos):
+        rows = X[keep_pos]
+        stop = start + X.shape[1]
+        segment = np.concatenate([rows[: start + k + 1, k] for k in range(X.shape[1])])
+        matrix[start * (start + 1) // 2 : stop * (stop + 1) // 2] = scale * segment
+    matrix.flush()
+    del matrix
+    write_matrix_lines(matrix_path, names)
+    return names
+
+
+def read_matrix_subset(matrix_path: Path | str, lines: Iterable[str]) -> pd.DataFrame:
+    """Square block of a stored matrix for the given lines, in the given order, read through the memmap."""
+    _, position = matrix_line_index(matrix_path)
+    lines = [line for line in dict.fromkeys(lines) if line in position]
+    pos = np.array([position[line] for line in lines], dtype=np.int64)
+    return pd.DataFrame(open_stored_matrix(matrix_path).block(pos, pos), index=lines, columns=lines)
+
+
+def plot_sample_lines(lines: list[str], max_lines: int = MAX_PLOT_LINES) -> list[str]:
+    """Evenly spaced lines (in stored order) for plotting matrices too large to draw whole."""
+    if len(lines) <= max_lines:
+        return list(lines)
+    picks = np.unique(np.linspace(0, len(lines) - 1, max_lines).round().astype(int))
+    return [lines[i] for i in picks]
+
+
+def csv_field(value: str) -> str:
+    if any(ch in value for ch in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def format_matrix_rows(labels: list[str], block: np.ndarray, decimals: int = MATRIX_CSV_DECIMALS) -> bytes:
+    """
+    CSV text for a block of matrix rows with fixed decimals, built with array ops.
+
+    Values in [0, 10), which covers A and co-ancestry, are written digit by digit
+    into a byte array of fixed-width cells; anything else falls back to printf
+    formatting.
+    """
+    scale = 10 ** decimals
+    fixed = np.rint(block.astype(np.float64, copy=False) * scale).astype(np.int64)
+    prefixes = [(csv_field(label) + ",").encode("utf-8") for label in labels]
+    if fixed.size and (fixed.min() < 0 or fixed.max() >= 10 * scale):
+        fmt = f"%.{decimals}f"
+        return b"".join(
+            prefix + ",".join(np.char.mod(fmt, row)).encode("ascii") + b"\n" for prefix, row in zip(prefixes, block)
+        )
+
+    width = decimals + 3
+    cells = np.empty(fixed.shape + (width,), dtype=np.uint8)
+    cells[..., 0] = ord("0") + fixed // scale
+    cells[..., 1] = ord(".")
+    frac = fixed % scale
+    for k in range(width - 2, 1, -1):
+        cells[..., k] = ord("0") + frac % 10
+        frac //= 10
+    cells[..., -1] = ord(",")
+    cells[:, -1, -1] = ord("\n")
+    body = cells.reshape(len(labels), -1)
+    return b"".join(prefix + row.tobytes() for prefix, row in zip(prefixes, body))
+
+
+def iter_matrix_csv(matrix_path: Path | str, decimals: int = MATRIX_CSV_DECIMALS):
+    """Yield a stored matrix as CSV bytes, one block of rows (about MATRIX_CSV_CHUNK_BYTES) at a time."""
+    matrix = open_stored_matrix(matrix_path)
+    names = matrix.lines
+    yield ("," + ",".join(csv_field(name) for name in names) + "\n").encode("utf-8")
+    rows_per_chunk = max(1, MATRIX_CSV_CHUNK_BYTES // max(1, matrix.n * (decimals + 19)))
+    for start in range(0, matrix.n, rows_per_chunk):
+        stop = min(start + rows_per_chunk, matrix.n)
+        yield format_matrix_rows(names[start:stop], matrix.row_block(start, stop), decimals)
+
+
+def iter_block_csv(block: pd.DataFrame, decimals: int = MATRIX_CSV_DECIMALS):
+    """Yield a (possibly rectangular) kinship block as CSV bytes, a block of rows at a time."""
+    names = [str(name) for name in block.index]
+    values = block.to_numpy()
+    yield ("," + ",".join(csv_field(str(name)) for name in block.columns) + "\n").encode("utf-8")
+    rows_per_chunk = max(1, MATRIX_CSV_CHUNK_BYTES // max(1, values.shape[1] * (decimals + 19)))
+    for start in range(0, len(names), rows_per_chunk):
+        yield format_matrix_rows(names[start:start + rows_per_chunk], values[start:start + rows_per_chunk], decimals)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_matrix_long_csv(matrix_path: Path | str, threshold: float = 0.0, decimals: int = MATRIX_CSV_DECIMALS):
+    """
+    Yield the lower triangle of a stored matrix as long-format CSV.
+
+    One Row, Column (1-based), RowLine, ColumnLine, Value record per entry with
+    |value| > threshold, so the structured zeros between unrelated families are
+    never written. Rows are read from the packed store in blocks; a block-diagonal
+    store is read block by block, which gives the same row order, and a
+    full-sib family store is expanded a block of rows at a time.
+    """
+    matrix = open_stored_matrix(matrix_path)
+    names = np.array(matrix.lines, dtype=object)
+    yield b"Row,Column,RowLine,ColumnLine,Value\n"
+    if isinstance(matrix, FamilyCompressedMatrix):
+        chunks = _iter_expanded_long_rows(matrix, names, threshold)
+    elif isinstance(matrix, BlockDiagonalMatrix):
+        chunks = (
+            chunk
+            for first, part in zip(matrix.offsets[:-1].tolist(), matrix.blocks)
+            for chunk in _iter_packed_long_rows(part, first, names, threshold)
+        )
+    else:
+        chunks = _iter_packed_long_rows(matrix, 0, names, threshold)
+    for chunk in chunks:
+        yield chunk.to_csv(header=False, index=False, float_format=f"%.{decimals}f").encode("utf-8")
+
+
+def _iter_packed_long_rows(matrix: PackedSymmetricMatrix, first: int, names: np.ndarray, threshold: float):
+    """Entries of a packed matrix whose lines start at position first, as long-format frames."""
+    rows_per_chunk = max(1, MATRIX_CSV_CHUNK_BYTES // max(1, 4 * matrix.n))
+    for start in range(0, matrix.n, rows_per_chunk):
+        stop = min(start + rows_per_chunk, matrix.n)
+        row_starts = np.arange(start, stop + 1, dtype=np.int64)
+        row_starts = row_starts * (row_starts + 1) // 2
+        values = np.asarray(matrix.values[row_starts[0]:row_starts[-1]])
+        offsets = np.flatnonzero(np.abs(values) > threshold)
+        if not len(offsets):
+            continue
+        local_rows = np.searchsorted(row_starts, offsets + row_starts[0], side="right") - 1
+        rows = local_rows + start + first
+        cols = offsets + row_starts[0] - row_starts[local_rows] + first
+        yield pd.DataFrame(
+            {"Row": rows + 1, "Column": cols + 1, "RowLine": names[rows], "ColumnLine": names[cols], "Value": values[offsets]}
+        )
+
+
+def _iter_expanded_long_rows(matrix, names: np.ndarray, threshold: float):
+    """Lower-triangle entries of any matrix with row_block(), as long-format frames."""
+    rows_per_chunk = max(1, MATRIX_CSV_CHUNK_BYTES // max(1, 8 * matrix.n))
+    for start in range(0, matrix.n, rows_per_chunk):
+        stop = min(start + rows_per_chunk, matrix.n)
+        dense = matrix.row_block(start, stop)
+        keep = (np.arange(matrix.n)[None, :] <= np.arange(start, stop)[:, None]) & (np.abs(dense) > threshold)
+        local_rows, cols = np.nonzero(keep)
+        if not len(cols):
+            continue
+        rows = local_rows + start
+        yield pd.DataFrame(
+            {"Row": rows + 1, "Column": cols + 1, "RowLine": names[rows], "ColumnLine": names[cols], "Value": dense[keep]}
+        )
+
+
+def export_matrix_npz(matrix_path: Path | str) -> Path:
+    """
+    Compressed .npz next to the stored matrix, written once.
+
+    Holds ``lines`` and ``lower_triangle``, the packed values in
+    np.tril_indices order: ``A[np.tril_indices(n)] = lower_triangle``.
+    """
+    out_path = Path(matrix_path).with_suffix(".npz")
+    if not out_path.exists():
+        matrix = open_stored_matrix(matrix_path)
+        partial_path = out_path.with_name(f".{out_path.stem}.{os.getpid()}.{time.time_ns()}.npz")
+        if not isinstance(matrix, PackedSymmetricMatrix):
+            # Block-diagonal and full-sib family stores are expanded here, through a temporary memmap.
+            expanded_path = partial_path.with_suffix(".npy")
+            write_packed_matrix(matrix, expanded_path)
+            lower_triangle = np.load(expanded_path, mmap_mode="r")
+        else:
+            expanded_path, lower_triangle = None, matrix.values
+        try:
+            np.savez_compressed(partial_path, lines=np.array(matrix.lines), lower_triangle=lower_triangle)
+        finally:
+            del lower_triangle
+            if expanded_path is not None:
+                expanded_path.unlink(missing_ok=True)
+        os.replace(partial_path, out_path)
+    return out_path
+
+
+def export_matrix_parquet(matrix_path: Path | str) -> Path:
+    """Wide Parquet (LineName plus one float32 column per line) next to the stored matrix, written once."""
+    out_path = Path(matrix_path).with_suffix(".parquet")
+    if not out_path.exists():
+        matrix = open_stored_matrix(matrix_path)
+        schema = pa.schema([("LineName", pa.string())] + [(name, pa.float32()) for name in matrix.lines])
+        partial_path = out_path.with_name(f".{out_path.stem}.{os.getpid()}.{time.time_ns()}.parquet")
+        rows_per_chunk = max(1, MATRIX_CSV_CHUNK_BYTES // max(1, 4 * matrix.n))
+        with pq.ParquetWriter(partial_path, schema, compression="zstd") as writer:
+            for start in range(0, matrix.n, rows_per_chunk):
+                stop = min(start + rows_per_chunk, matrix.n)
+                block = matrix.row_block(start, stop).astype(np.float32)
+                arrays = [pa.array(matrix.lines[start:stop])] + [pa.array(block[:, k]) for k in range(matrix.n)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        os.replace(partial_path, out_path)
+    return out_path
+
+# =============================================================================
+# Matrix cache
+# =============================================================================
+
+
+def pedigree_content_hash(source_df: pd.DataFrame) -> str:
+    """Hash of the pedigree columns, memoized on the frame's graph."""
+    graph = get_pedigree_graph(source_df)
+    digest = graph.derived.get("content_hash")
+    if digest is None:
+        hashed = pd.util.hash_pandas_object(source_df[REQUIRED_PEDIGREE_COLUMNS], index=False)
+        digest = graph.derived["content_hash"] = hashlib.sha256(hashed.to_numpy().tobytes()).hexdigest()
+    return digest
+
+
+def matrix_cache_key(source_df: pd.DataFrame, lines: Iterable[str], method_choice: int, expansion: str, precision: str) -> str:
+    payload = json.dumps([pedigree_content_hash(source_df), sorted(lines), method_choice, expansion, precision])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def load_cached_matrix(key: str) -> Optional[dict]:
+    """Return the cache entry for key and mark it as recently used, or None."""
+    entry_file = MATRIX_CACHE_DIR / key / "entry.json"
+    try:
+        entry = json.loads(entry_file.read_text(encoding="utf-8"))
+        os.utime(entry_file)
+    except (OSError, ValueError):
+        return None
+    entry["lines"] = read_matrix_lines(MATRIX_CACHE_DIR / key / entry["matrix"])
+    return entry
+
+
+def new_cache_workdir(key: str) -> Path:
+    work_dir = MATRIX_CACHE_DIR / f".{key}.{os.getpid()}.{time.time_ns()}"
+    work_dir.mkdir(parents=True)
+    return work_dir
+
+
+def commit_cache_entry(work_dir: Path, key: str, entry: dict) -> Path:
+    """
+    Publish a finished work directory as the entry for key, then evict.
+
+    The directory is renamed into place so readers never see a partial entry;
+    if another request finished the same key first, that copy is kept.
+    """
+    (work_dir / "entry.json").write_text(json.dumps(entry), encoding="utf-8")
+    entry_dir = MATRIX_CACHE_DIR / key
+    try:
+        os.rename(work_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    evict_matrix_cache(keep=key)
+    return entry_dir
+
+
+def find_extendable_matrix(
+    lines: Iterable[str], source_df, method_choice: int, precision: str
+) -> Optional[tuple[PackedSymmetricMatrix, dict[str, tuple[str, str]]]]:
+    """
+    Largest recent cached matrix that compute_packed_lines can extend to lines.
+
+    Only entries saved with their parents qualify. The pedigree itself may have
+    changed since, e.g. after appending seedlings; what matters is that each
+    cached line still has the same parents within the new line set. Checks the
+    MATRIX_EXTEND_CANDIDATES most recently used entries for the same method and
+    precision, and returns the matrix memory-mapped, or None. Entries holding
+    fewer than MATRIX_EXTEND_MIN_FRACTION of the lines are skipped, so a small
+    cached set does not keep a large build off the block and family paths.
+    """
+    parents = subset_parents(lines, source_df)
+    min_lines = MATRIX_EXTEND_MIN_FRACTION * len(parents)
+    candidates = []
+    for entry_dir in MATRIX_CACHE_DIR.iterdir():
+        entry_file = entry_dir / "entry.json"
+        try:
+            entry = json.loads(entry_file.read_text(encoding="utf-8"))
+            if entry.get("incremental") == {"method": method_choice, "precision": precision}:
+                candidates.append((entry_file.stat().st_mtime, entry_dir / entry["matrix"]))
+        except (OSError, ValueError):
+            continue
+
+    best = None
+    for _, matrix_file in sorted(candidates, reverse=True)[:MATRIX_EXTEND_CANDIDATES]:
+        try:
+            old_lines = read_matrix_lines(matrix_file)
+            if not min_lines <= len(old_lines) <= len(parents) or (best is not None and len(old_lines) <= best[0].n):
+                continue
+            old_parents = read_matrix_parents(matrix_file)
+            if all(parents.get(line) == old_parents.get(line) for line in old_lines):
+                best = (open_stored_matrix(matrix_file), old_parents)
+        except (OSError, ValueError):
+            continue
+    return best
+
+
+def evict_matrix_cache(keep: Optional[str] = None) -> None:
+    """Drop least-recently-used entries until the cache fits MATRIX_CACHE_BYTES."""
+    entries = []
+    for entry_dir in MATRIX_CACHE_DIR.iterdir():
+        entry_file = entry_dir / "entry.json"
+        if not entry_file.exists():
+            continue
+        size = sum(path.stat().st_size for path in entry_dir.iterdir() if path.is_file())
+        entries.append((entry_file.stat().st_mtime, entry_dir, size))
+    total = sum(size for _, _, size in entries)
+    for _, entry_dir, size in sorted(entries, key=lambda item: item[0]):
+        if total <= MATRIX_CACHE_BYTES:
+            break
+        if entry_dir.name == keep:
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+
+# pyplot keeps one global figure state, so concurrent requests render one at a time.
+_render_lock = threading.Lock()
+
+
+def render_matrix_heatmap(plot_matrix: pd.DataFrame, n_lines: int, heatmap_file: Path, n_cols: Optional[int] = None) -> None:
+    """Draw a square matrix, or an n_lines × n_cols rectangular block when n_cols is given."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    square = n_cols is None
+    n_cols = n_lines if square else n_cols
+    figsize = (15, 15) if square else (15, min(15, max(4, 15 * plot_matrix.shape[0] / max(1, plot_matrix.shape[1]))))
+    with _render_lock:
+        if max(n_lines, n_cols) <= MAX_CLUSTER_SIZE and min(plot_matrix.shape) > 1:
+            heatmap_plot = sns.clustermap(plot_matrix, method="average", cmap="Spectral", figsize=figsize)
+            heatmap_plot.savefig(heatmap_file, dpi=450, bbox_inches="tight")
+            plt.close(heatmap_plot.fig)
+        else:
+            plt.figure(figsize=figsize)
+            sns.heatmap(plot_matrix, cmap="Spectral")
+            if not square:
+                shown = "" if plot_matrix.shape == (n_lines, n_cols) else f"evenly spaced {plot_matrix.shape[0]:,} × {plot_matrix.shape[1]:,} of "
+                plt.title(f"Kinship block: {shown}{n_lines:,} candidates × {n_cols:,} references")
+            elif len(plot_matrix) < n_lines:
+                plt.title(f"Heatmap of {len(plot_matrix):,} evenly spaced lines out of {n_lines:,}")
+            else:
+                plt.title(f"Heatmap without clustering ({n_lines:,} lines > {MAX_CLUSTER_SIZE})")
+            plt.savefig(heatmap_file, dpi=450, bbox_inches="tight")
+            plt.close()
+
+# =============================================================================
+# Layout
+# =============================================================================
+
+app.layout = html.Div([dcc.Location(id="url", refresh=False), html.Div(id="page-content")])
+
+
+def base_layout(content):
+    return dbc.Container(
+        [
+            dbc.Row(
+                [
+                    dbc.Col(
+                        html.Div(
+                            [
+                                html.Button(
+                                    html.I(className="fas fa-home"),
+                                    id="home-button",
+                                    style=CUSTOM_CSS["round_button"],
+                                ),
+                                html.Button(
+                                    html.I(className="fas fa-table"),
+                                    id="view-data-button",
+                                    style={**CUSTOM_CSS["round_button"], "backgroundColor": "#27ae60"},
+                                ),
+                            ],
+                            style=CUSTOM_CSS["left_button_group"],
+                        ),
+                        width=6,
+                    ),
+                    dbc.Col(
+                        html.Div(
+                            [
+                                html.Button(
+                                    html.I(className="fas fa-trash"),
+                                    id="clear-data-button",
+                                    style={**CUSTOM_CSS["round_button"], "backgroundColor": "#e74c3c"},
+                                ),
+                                html.Button("?", id="open-info-modal", style=CUSTOM_CSS["round_button"]),
+                            ],
+                            style=CUSTOM_CSS["right_button_group"],
+                        ),
+                        width=6,
+                    ),
+                ]
+            ),
+            dbc.Row(
+                dbc.Col(
+                    html.H1("CaneCestry", className="app-header", style={**CUSTOM_CSS["header"], "fontSize": "60px"})
+                )
+            ),
+            dbc.Row(dbc.Col(html.Div(id="common-content", children=content))),
+            dbc.Modal(
+                [
+                    dbc.ModalHeader(dbc.ModalTitle("CaneCestry 2.0 – User Reference")),
+                    dbc.ModalBody(
+                        html.Div(
+                            [
+                                html.H4("Overview"),
+                                html.P(
+                                    "CaneCestry supports pedigree management, pedigree visualization, "
+                                    "ancestry queries, and generation of Henderson A-matrices or coancestry matrices."
+                                ),
+                                html.H4("Matrix Generation"),
+                                html.P(
+                                    "Use one page, one Generate button, and the pedigree-expansion slider to choose "
+                                    "Selected lines only, Selected lines + ancestors, or Selected lines + ancestors + descendants. "
+                                    "With Selected lines only, tick the exact-relationships option to trace relationships "
+                                    "through the whole pedigree while keeping only the selected rows and columns."
+                                ),
+                                html.H4("Pedigree Explorer"),
+                                html.Ul(
+                                    [
+                                        html.Li("Specific pairing lookup."),
+                                        html.Li("Single-parent progeny lookup."),
+                                        html.Li("SVG family trees with generation-depth control."),
+                                        html.Li("Male/female lineage highlighting using blue/red border emphasis."),
+                                        html.Li("Descendant, combined-family, and temporary-progeny trees."),
+                                    ]
+                                ),
+                                html.H4("Add Pedigree Entries"),
+                                html.P(
+                                    "Upload rows with LineName, FemaleParent, and MaleParent. Valid rows are saved, "
+                                    "and rows with unrecognized parents can be corrected before saving."
+                                ),
+                            ],
+                            style={"fontSize": "15px"},
+                        )
+                    ),
                     dbc.ModalFooter(dbc.Button("Close", id="close-info-modal", className="ms-auto")),
                 ],
                 id="info-modal",
@@ -1828,6 +3751,39 @@ def main_page_layout():
             ),
             justify="center",
         ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Checklist(
+                    id="exact-selected-checklist",
+                    options=[
+                        {
+                            "label": " Selected only: exact relationships through the full pedigree (keeps only the selected rows/columns)",
+                            "value": "exact",
+                        }
+                    ],
+                    value=[],
+                ),
+                width="auto",
+            ),
+            justify="center",
+        ),
+        dbc.Row(dbc.Col(html.Label("Matrix precision:", style={"fontWeight": "bold"}))),
+        dbc.Row(
+            dbc.Col(
+                dcc.RadioItems(
+                    id="matrix-precision-radio",
+                    options=[
+                        {"label": " float64", "value": "float64"},
+                        {"label": " float32 (half the memory, about 7 significant digits)", "value": "float32"},
+                    ],
+                    value="float64",
+                    inline=True,
+                    labelStyle={"marginRight": "20px"},
+                ),
+                width="auto",
+            ),
+            justify="center",
+        ),
         html.Br(),
         dbc.Row(
             [
@@ -1863,6 +3819,21 @@ def main_page_layout():
             style={"marginTop": "20px"},
             className="mb-4",
         ),
+        dbc.Row(
+            [
+                dbc.Col(html.Div(id="matrix-export-links"), width="auto"),
+                dbc.Col(
+                    html.Div(
+                        [
+                            html.Label("Long format: keep |value| above", style={"marginRight": "8px"}),
+                            dcc.Input(id="long-format-threshold", type="number", value=0, min=0, step=0.001, style={"width": "110px"}),
+                        ]
+                    ),
+                    width="auto",
+                ),
+            ],
+            align="center",
+        ),
         dbc.Row(dbc.Col(html.Div(id="matrix-status", style={"fontWeight": "bold", "marginTop": "10px"}))),
         dcc.Loading(
             dbc.Row(dbc.Col(html.Img(id="heatmap-image", src="", style={"width": "100%", "padding": "10px"}))),
@@ -1879,6 +3850,50 @@ def main_page_layout():
             )
         ),
         html.Hr(),
+        dbc.Card(
+            dbc.CardBody(
+                [
+                    html.H4("Candidate × reference kinship block"),
+                    html.P(
+                        "Paste candidate lines and reference lines to get only the candidates × references block, with "
+                        "exact relationships through the full pedigree. The square matrix over both lists is never built. "
+                        "Uses the relationship calculation selected above."
+                    ),
+                    dbc.Row(
+                        [
+                            dbc.Col(
+                                dcc.Textarea(
+                                    id="block-candidate-lines",
+                                    placeholder="Candidate lines (one per line or comma-separated)",
+                                    style={"width": "100%", "height": "130px"},
+                                ),
+                                width=6,
+                            ),
+                            dbc.Col(
+                                dcc.Textarea(
+                                    id="block-reference-lines",
+                                    placeholder="Reference lines (one per line or comma-separated)",
+                                    style={"width": "100%", "height": "130px"},
+                                ),
+                                width=6,
+                            ),
+                        ]
+                    ),
+                    html.Button("Generate Kinship Block", id="generate-kinship-block-button", className="btn btn-info", style=CUSTOM_CSS["button"]),
+                    html.A(
+                        "Download Kinship Block (CSV)",
+                        id="download-kinship-block-link",
+                        href="",
+                        download="kinship_block.csv",
+                        className="btn btn-success",
+                        style={**CUSTOM_CSS["button"], "display": "none"},
+                    ),
+                    html.Div(id="kinship-block-status", style={"fontWeight": "bold", "marginTop": "10px"}),
+                    dcc.Loading(html.Img(id="kinship-block-heatmap", src="", style={"width": "100%", "padding": "10px"}), type="default"),
+                ]
+            ),
+            className="mb-3",
+        ),
         dbc.Card(
             dbc.CardBody(
                 [
@@ -1946,12 +3961,18 @@ def pedigree_explorer_layout():
                         {"label": "Generate descendant tree", "value": "descendant-tree"},
                         {"label": "Generate combined family tree for two lines", "value": "combined-family-tree"},
                         {"label": "Generate family tree with temporary progeny", "value": "temp-progeny-tree"},
+                        {"label": "Crossing block mate evaluation", "value": "crossing-block"},
                         {"label": "Interactive pedigree viewer", "value": "interactive-pedigree"},
                         {"label": "Generation ring layout", "value": "generation-ring"},
                         {"label": "Group / era / founder insights", "value": "group-era-insights"},
                         {"label": "Ancestor contribution chart", "value": "ancestor-contribution"},
                         {"label": "Furthest direct male/female ancestors", "value": "direct-line-ancestors"},
                         {"label": "Terminal ancestors by male/female branch", "value": "terminal-branch-ancestors"},
+                        {"label": "Inbreeding coefficients for the whole pedigree", "value": "whole-pedigree-inbreeding"},
+                        {"label": "Sparse A-inverse for mixed models", "value": "whole-pedigree-ainverse"},
+                        {"label": "Pairwise kinship lookup", "value": "pairwise-kinship"},
+                        {"label": "Mean kinship to the population or a group", "value": "mean-kinship"},
+                        {"label": "Diversity core set (greedy minimum coancestry)", "value": "core-set"},
                     ],
                     multi=True,
                     placeholder="Select one or more functions",
@@ -2134,9 +4155,9 @@ def update_line_selection(selected_lines, pasted_lines):
     selected_lines = selected_lines or []
     if not pasted_lines:
         return selected_lines
-    valid_names = set(filtered_df["LineName"].astype(str).tolist())
+    graph = get_pedigree_graph(filtered_df)
     pasted = [name.strip() for name in pasted_lines.split(",") if name.strip()]
-    merged = list(dict.fromkeys(selected_lines + [name for name in pasted if name in valid_names]))
+    merged = list(dict.fromkeys(selected_lines + [name for name in pasted if graph.has_line(name)]))
     return merged
 
 
@@ -2161,62 +4182,254 @@ def update_selected_line_names_list(selected_line_names):
         State("line-name-dropdown", "value"),
         State("kinship-method-slider", "value"),
         State("pedigree-expansion-slider", "value"),
+        State("exact-selected-checklist", "value"),
+        State("matrix-precision-radio", "value"),
     ],
     prevent_initial_call=True,
 )
-def generate_amatrix_and_heatmap(n_clicks, selected_line_names, method_choice, expansion_choice):
+def generate_amatrix_and_heatmap(n_clicks, selected_line_names, method_choice, expansion_choice, exact_values, precision):
     if not n_clicks or not selected_line_names:
         raise PreventUpdate
 
+    # One snapshot for the whole request, so a concurrent upload cannot mix pedigrees.
+    source_df = filtered_df
     start_time = time.time()
-    if expansion_choice == 0:
-        all_related_lines = collect_selected_only(selected_line_names, filtered_df)
+    exact_selected = expansion_choice == 0 and "exact" in (exact_values or [])
+    if exact_selected:
+        all_related_lines = collect_selected_only(selected_line_names, source_df)
+        expansion_label = "selected lines only (exact relationships through the full pedigree)"
+        expansion_choice = "exact"
+    elif expansion_choice == 0:
+        all_related_lines = collect_selected_only(selected_line_names, source_df)
         expansion_label = "selected lines only"
     elif expansion_choice == 2:
-        all_related_lines = collect_lines_with_ancestors_and_descendants(selected_line_names, filtered_df)
+        all_related_lines = collect_lines_with_ancestors_and_descendants(selected_line_names, source_df)
         expansion_label = "selected lines + ancestors + descendants"
     else:
-        all_related_lines = collect_lines_with_ancestors(selected_line_names, filtered_df)
+        all_related_lines = collect_lines_with_ancestors(selected_line_names, source_df)
         expansion_label = "selected lines + ancestors"
 
     if not all_related_lines:
         return "", "", "", {**CUSTOM_CSS["button"], "display": "none"}, None, "No valid selected lines were found in the active pedigree."
 
-    relatives_df = filtered_df[filtered_df["LineName"].isin(all_related_lines)].copy()
-    current_matrix = compute_selected_matrix(relatives_df, method_choice)
-
-    timestamp = int(time.time())
-    matrix_file = OUTPUT_DIR / f"full_matrix_{timestamp}.csv"
-    current_matrix.to_csv(matrix_file)
-    full_matrix_link = f"/download?filename={urllib.parse.quote(str(matrix_file))}&type=full"
-
-    heatmap_file = OUTPUT_DIR / f"heatmap_{timestamp}.png"
-    n_lines = len(current_matrix)
-    if n_lines <= MAX_CLUSTER_SIZE:
-        heatmap_plot = sns.clustermap(current_matrix, method="average", cmap="Spectral", figsize=(15, 15))
-        heatmap_plot.savefig(heatmap_file, dpi=450, bbox_inches="tight")
-        plt.close(heatmap_plot.fig)
+    precision = precision or "float64"
+    key = matrix_cache_key(source_df, all_related_lines, method_choice, str(expansion_choice), precision)
+    entry = load_cached_matrix(key)
+    if entry is None:
+        entry_dir, entry = build_matrix_cache_entry(
+            key, all_related_lines, method_choice, exact_selected, precision, expansion_label, source_df
+        )
+        verb = "Generated"
     else:
-        plt.figure(figsize=(15, 15))
-        sns.heatmap(current_matrix, cmap="Spectral")
-        plt.title(f"Heatmap without clustering ({n_lines:,} lines > {MAX_CLUSTER_SIZE})")
-        plt.savefig(heatmap_file, dpi=450, bbox_inches="tight")
-        plt.close()
+        entry_dir = MATRIX_CACHE_DIR / key
+        verb = "Loaded cached"
 
+    matrix_file = entry_dir / entry["matrix"]
+    heatmap_file = entry_dir / entry["heatmap"]
+    # Only the path goes to the browser; line names are read from the sidecar index.
+    store = {"path": str(matrix_file)}
+    full_matrix_link = f"/download?filename={urllib.parse.quote(str(matrix_file))}&type=full"
     heatmap_src = f"/download?filename={urllib.parse.quote(str(heatmap_file))}&type=image"
     heatmap_download = f"/download?filename={urllib.parse.quote(str(heatmap_file))}&type=png_download"
     heatmap_style = {**CUSTOM_CSS["button"], "display": "inline-block"}
     elapsed = time.time() - start_time
-    status = f"Generated {n_lines:,} × {n_lines:,} matrix using {expansion_label} in {elapsed:.2f} seconds."
-    store = {"path": str(matrix_file), "lines": current_matrix.index.tolist()}
+    n_lines = len(entry["lines"])
+    status = f"{verb} {n_lines:,} × {n_lines:,} matrix using {entry['label']}{entry.get('note', '')} in {elapsed:.2f} seconds."
     return heatmap_src, full_matrix_link, heatmap_download, heatmap_style, store, status
 
 
+@app.callback(
+    [
+        Output("kinship-block-heatmap", "src"),
+        Output("download-kinship-block-link", "href"),
+        Output("download-kinship-block-link", "style"),
+        Output("kinship-block-status", "children"),
+    ],
+    Input("generate-kinship-block-button", "n_clicks"),
+    [
+        State("block-candidate-lines", "value"),
+        State("block-reference-lines", "value"),
+        State("kinship-method-slider", "value"),
+    ],
+    prevent_initial_call=True,
+)
+def generate_kinship_block(n_clicks, candidate_text, reference_text, method_choice):
+    if not n_clicks:
+        raise PreventUpdate
+
+    hidden = {**CUSTOM_CSS["button"], "display": "none"}
+    candidates = [name.strip() for name in re.split(r"[,;\t\n]+", candidate_text or "") if name.strip()]
+    references = [name.strip() for name in re.split(r"[,;\t\n]+", reference_text or "") if name.strip()]
+    source_df = filtered_df
+    graph = get_pedigree_graph(source_df)
+    missing = [name for name in dict.fromkeys(candidates + references) if not graph.has_line(name)]
+
+    start_time = time.time()
+    block = kinship_block(candidates, references, source_df, method_choice or 0)
+    if block.size == 0:
+        return "", "", hidden, "Enter at least one candidate and one reference line found in the active pedigree."
+
+    stamp = int(time.time())
+    csv_file = OUTPUT_DIR / f"kinship_block_{stamp}.csv"
+    with open(csv_file, "wb") as fh:
+        fh.writelines(iter_block_csv(block))
+    heatmap_file = OUTPUT_DIR / f"kinship_block_{stamp}.png"
+    plot_block = block.loc[plot_sample_lines(list(block.index)), plot_sample_lines(list(block.columns))]
+    render_matrix_heatmap(plot_block, block.shape[0], heatmap_file, n_cols=block.shape[1])
+    elapsed = time.time() - start_time
+
+    status = f"Generated {block.shape[0]:,} × {block.shape[1]:,} kinship block in {elapsed:.2f} seconds."
+    if missing:
+        status += f" Not in the active pedigree: {', '.join(missing[:10])}{' …' if len(missing) > 10 else ''}."
+    heatmap_src = f"/download?filename={urllib.parse.quote(str(heatmap_file))}&type=image"
+    href = f"/download?filename={urllib.parse.quote(str(csv_file))}&type=csv"
+    return heatmap_src, href, {**CUSTOM_CSS["button"], "display": "inline-block"}, status
+
+
+def build_matrix_cache_entry(
+    key: str,
+    lines: list[str],
+    method_choice: int,
+    exact_selected: bool,
+    precision: str,
+    expansion_label: str,
+    source_df: pd.DataFrame,
+) -> tuple[Path, dict]:
+    """
+    Compute a matrix and its heatmap into a new cache entry from source_df.
+
+    source_df is the pedigree snapshot the request started with, not the
+    global filtered_df, which an upload may replace mid-request.
+
+    The returned entry also has the line order and a note about this build
+    only, such as reuse of a cached matrix; neither is stored.
+    """
+    dtype = np.float32 if precision == "float32" else np.float64
+    # Describes this build only, e.g. reuse of another entry, so it is not stored.
+    note = ""
+    work_dir = new_cache_workdir(key)
+    matrix_file = work_dir / "matrix.npy"
+    # A half-written work directory has no entry.json, so eviction would never remove it.
+    try:
+        # A cached matrix for a subset of the lines is extended rather than rebuilt.
+        previous = None
+        if not exact_selected and not matrix_exceeds_ram_budget(len(lines), dtype):
+            previous = find_extendable_matrix(lines, source_df, method_choice, precision)
+        # Otherwise unrelated groups, or full-sib families, are held compressed when that fits in RAM.
+        matrix = None
+        if not exact_selected and previous is None:
+            components = split_pedigree_components(lines, source_df, min_lines=BLOCK_MIN_LINES)
+            if use_block_diagonal(components, dtype):
+                matrix = compute_block_diagonal_matrix(components, method_choice, dtype)
+                expansion_label += f", {len(components):,} unrelated blocks"
+            else:
+                families = full_sib_families(lines, source_df)
+                if (
+                    len(families[0]) >= FAMILY_COMPRESSION_MIN_RATIO * len(families[2])
+                    and not matrix_exceeds_ram_budget(len(families[2]), dtype)
+                ):
+                    matrix = compute_family_compressed_matrix(*families, method_choice=method_choice, dtype=dtype)
+                    expansion_label += f", {len(families[2]):,} full-sib families"
+        if isinstance(matrix, BlockDiagonalMatrix):
+            # Stored as blocks; only exports expand the zeros between them.
+            write_block_matrix(matrix, matrix_file)
+        elif matrix is not None:
+            # Stored one row per family; only exports expand the sibs.
+            write_family_matrix(matrix, matrix_file)
+        if matrix is not None:
+            write_matrix_lines(matrix_file, matrix.lines)
+            write_matrix_parents(matrix_file, subset_parents(matrix.lines, source_df))
+            line_order = matrix.lines
+            plot_matrix = matrix.subset(plot_sample_lines(line_order))
+        elif matrix_exceeds_ram_budget(len(lines), dtype):
+            # Too large for RAM: stream to a memory-mapped file and plot an evenly spaced sample.
+            line_order = write_kinship_memmap(
+                matrix_file, lines, source_df, method_choice, trace_ancestors=exact_selected, dtype=dtype
+            )
+            plot_matrix = read_matrix_subset(matrix_file, plot_sample_lines(line_order))
+            expansion_label += ", out-of-core"
+        else:
+            # Kept packed; dense DataFrames are only built for the plotted lines.
+            if exact_selected:
+                exact_matrix = compute_exact_selected_matrix(lines, source_df, method_choice)
+                packed = PackedSymmetricMatrix.from_dense(exact_matrix.index.tolist(), exact_matrix.to_numpy(), dtype)
+            else:
+                packed, reused = compute_packed_lines(lines, source_df, method_choice, dtype, previous)
+                if reused == packed.n:
+                    note = ", reusing a cached matrix"
+                elif reused:
+                    note = f", extending a cached {reused:,}-line matrix"
+            # The packed triangle is the stored layout; the CSV is only written on download.
+            np.save(matrix_file, packed.values)
+            write_matrix_lines(matrix_file, packed.lines)
+            if not exact_selected:
+                write_matrix_parents(matrix_file, subset_parents(packed.lines, source_df))
+            line_order = packed.lines
+            plot_matrix = packed.subset(plot_sample_lines(packed.lines))
+
+        render_matrix_heatmap(plot_matrix, len(line_order), work_dir / "heatmap.png")
+        entry = {"matrix": matrix_file.name, "heatmap": "heatmap.png", "label": expansion_label}
+        if matrix_parents_path(matrix_file).exists():
+            entry["incremental"] = {"method": method_choice, "precision": precision}
+        entry_dir = commit_cache_entry(work_dir, key, entry)
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    entry["lines"] = line_order
+    entry["note"] = note
+    return entry_dir, entry
+
+
+@app.callback(
+    Output("matrix-export-links", "children"),
+    [Input("matrix-store", "data"), Input("long-format-threshold", "value")],
+)
+def update_matrix_export_links(matrix_data, threshold):
+    matrix_path = (matrix_data or {}).get("path")
+    if not matrix_path:
+        return []
+    links = [
+        html.A(
+            "Download Full Matrix (CSV, gzip)",
+            href=download_href(matrix_path, "full") + "&compression=gzip",
+            download="full_matrix.csv.gz",
+            className="btn btn-success",
+            style=DOWNLOAD_BUTTON_STYLE,
+        ),
+        html.A(
+            "Long format (i, j, value)",
+            href=download_href(matrix_path, "long") + f"&threshold={float(threshold or 0)}",
+            download="kinship_long.csv",
+            className="btn btn-secondary",
+            style=DOWNLOAD_BUTTON_STYLE,
+        ),
+        html.A(
+            "Compressed NPZ",
+            href=download_href(matrix_path, "npz"),
+            download="kinship_matrix.npz",
+            className="btn btn-secondary",
+            style=DOWNLOAD_BUTTON_STYLE,
+        ),
+    ]
+    if HAS_PYARROW:
+        links.append(
+            html.A(
+                "Parquet (float32)",
+                href=download_href(matrix_path, "parquet"),
+                download="kinship_matrix.parquet",
+                className="btn btn-secondary",
+                style=DOWNLOAD_BUTTON_STYLE,
+            )
+        )
+    return links
+
+
 @app.callback(Output("subset-dropdown", "options"), Input("matrix-store", "data"))
 def update_subset_dropdown_options(matrix_data):
-    if not matrix_data:
+    matrix_path = (matrix_data or {}).get("path")
+    if not matrix_path or not os.path.exists(matrix_path):
         return []
-    return [{"label": line, "value": line} for line in matrix_data.get("lines", [])]
+    return [{"label": line, "value": line} for line in read_matrix_lines(matrix_path)]
 
 
 @app.callback(
@@ -2230,11 +4443,9 @@ def display_subset_matrix(subset_values, matrix_data):
     matrix_path = matrix_data.get("path")
     if not matrix_path or not os.path.exists(matrix_path):
         return "Matrix file not found. Regenerate the matrix."
-    full_matrix = pd.read_csv(matrix_path, index_col=0)
-    subset_values = [line for line in subset_values if line in full_matrix.index]
-    if not subset_values:
+    subset_matrix = read_matrix_subset(matrix_path, subset_values)
+    if subset_matrix.empty:
         return "No selected subset lines are in the current matrix."
-    subset_matrix = full_matrix.loc[subset_values, subset_values]
     rounded = subset_matrix.round(4)
     header = html.Thead(html.Tr([html.Th("")] + [html.Th(col) for col in rounded.columns]))
     body = html.Tbody(
@@ -2257,11 +4468,9 @@ def make_subset_download(selected_lines, matrix_data):
     matrix_path = matrix_data.get("path")
     if not matrix_path or not os.path.exists(matrix_path):
         raise PreventUpdate
-    full_matrix = pd.read_csv(matrix_path, index_col=0)
-    selected_lines = [line for line in selected_lines if line in full_matrix.index]
-    if not selected_lines:
+    subset = read_matrix_subset(matrix_path, selected_lines)
+    if subset.empty:
         raise PreventUpdate
-    subset = full_matrix.loc[selected_lines, selected_lines]
     subset_file = OUTPUT_DIR / f"subset_matrix_{int(time.time())}.csv"
     subset.to_csv(subset_file)
     return f"/download?filename={urllib.parse.quote(str(subset_file))}&type=subset"
@@ -2545,6 +4754,64 @@ def display_selected_progeny_modules(selected_functions):
             )
         )
 
+    if "crossing-block" in selected_functions:
+        modules.append(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H4("Crossing block mate evaluation"),
+                        html.P(
+                            "Scores every female × male combination by the expected inbreeding of its progeny (the parents' "
+                            "coancestry) from one rectangular kinship block, then lists the best or worst crosses."
+                        ),
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    dcc.Textarea(
+                                        id="crossing-block-females",
+                                        placeholder="Female parents (one per line or comma-separated)",
+                                        style={"width": "100%", "height": "130px"},
+                                    ),
+                                    width=6,
+                                ),
+                                dbc.Col(
+                                    dcc.Textarea(
+                                        id="crossing-block-males",
+                                        placeholder="Male parents (one per line or comma-separated)",
+                                        style={"width": "100%", "height": "130px"},
+                                    ),
+                                    width=6,
+                                ),
+                            ]
+                        ),
+                        dcc.RadioItems(
+                            id="crossing-block-order-radio",
+                            options=[
+                                {"label": "Lowest coancestry first", "value": "lowest"},
+                                {"label": "Highest coancestry first", "value": "highest"},
+                            ],
+                            value="lowest",
+                            inline=True,
+                        ),
+                        html.Label("Show top", style={"marginRight": "8px"}),
+                        dcc.Input(id="crossing-block-top-k", type="number", value=50, min=1, step=1, style={"width": "100px"}),
+                        html.Br(),
+                        html.Button("Evaluate Crosses", id="generate-crossing-block-button", style=CUSTOM_CSS["button"]),
+                        html.A(
+                            "Download All Ranked Crosses",
+                            id="download-crossing-block-link",
+                            href="",
+                            className="btn btn-success",
+                            style={**CUSTOM_CSS["button"], "display": "none"},
+                        ),
+                        dcc.Loading(html.Div(id="crossing-block-summary", style={"fontWeight": "bold", "marginTop": "10px"}), type="default"),
+                        html.Div(id="crossing-block-table", style=CUSTOM_CSS["table_wrap"]),
+                    ]
+                ),
+                className="mb-3",
+            )
+        )
+
     if "interactive-pedigree" in selected_functions:
         modules.append(
             dbc.Card(
@@ -2693,98 +4960,295 @@ def display_selected_progeny_modules(selected_functions):
                                 ),
                             ]
                         ),
-                        html.Button("Generate Ancestor Contribution", id="generate-ancestor-contribution-button", style=CUSTOM_CSS["button"]),
-                        dcc.Loading(dcc.Graph(id="ancestor-contribution-plot", config=HIGHRES_GRAPH_CONFIG), type="default"),
-                        html.Div(id="ancestor-contribution-table", style=CUSTOM_CSS["table_wrap"]),
+                        html.Button("Generate Ancestor Contribution", id="generate-ancestor-contribution-button", style=CUSTOM_CSS["button"]),
+                        dcc.Loading(dcc.Graph(id="ancestor-contribution-plot", config=HIGHRES_GRAPH_CONFIG), type="default"),
+                        html.Div(id="ancestor-contribution-table", style=CUSTOM_CSS["table_wrap"]),
+                    ]
+                ),
+                className="mb-3",
+            )
+        )
+
+    if "direct-line-ancestors" in selected_functions:
+        modules.append(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H4("Furthest direct male/female ancestors"),
+                        html.P(
+                            "Paste genotype names and the app will follow the direct male line "
+                            "(male parent of male parent, etc.) and direct female line "
+                            "(female parent of female parent, etc.) until each side terminates."
+                        ),
+                        dcc.Textarea(
+                            id="direct-line-genotype-input",
+                            placeholder="Examples:\nL01-299\nHoCP96-540\nLCP85-384",
+                            style={"width": "100%", "height": "130px"},
+                        ),
+                        html.Br(),
+                        html.Button("Find Furthest Direct Ancestors", id="generate-direct-line-ancestors-button", style=CUSTOM_CSS["button"]),
+                        html.Div(id="direct-line-ancestors-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        html.A(
+                            "Download Direct-Line Ancestor Table",
+                            id="download-direct-line-ancestors-link",
+                            href="",
+                            className="btn btn-success",
+                            style={**CUSTOM_CSS["button"], "display": "none"},
+                        ),
+                        html.Div(id="direct-line-ancestors-table", style=CUSTOM_CSS["table_wrap"]),
+                    ]
+                ),
+                className="mb-3",
+            )
+        )
+
+
+
+    if "terminal-branch-ancestors" in selected_functions:
+        modules.append(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H4("Terminal ancestors by male/female branch"),
+                        html.P(
+                            "Paste genotype names and the app will return every terminal/founder ancestor path found separately "
+                            "from the input genotype's MaleParent branch and FemaleParent branch. The output is long-format "
+                            "so it can be analyzed for cytoplasmic/chloroplast inheritance. Rows where AllFemaleParentPath is TRUE "
+                            "are the direct maternal-line candidates."
+                        ),
+                        dcc.Textarea(
+                            id="terminal-branch-genotype-input",
+                            placeholder="Examples:\nL01-299\nHoCP96-540\nLCP85-384",
+                            style={"width": "100%", "height": "140px"},
+                        ),
+                        html.Br(),
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    [
+                                        html.Label("Max generations to search", style={"fontWeight": "bold"}),
+                                        dcc.Input(
+                                            id="terminal-branch-max-depth",
+                                            type="number",
+                                            min=1,
+                                            max=30,
+                                            step=1,
+                                            value=12,
+                                            style={"width": "100%"},
+                                        ),
+                                    ],
+                                    width=3,
+                                ),
+                            ]
+                        ),
+                        html.Br(),
+                        html.Button("Find Terminal Branch Ancestors", id="generate-terminal-branch-ancestors-button", style=CUSTOM_CSS["button"]),
+                        html.Div(id="terminal-branch-ancestors-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        html.A(
+                            "Download Terminal Branch Ancestor CSV",
+                            id="download-terminal-branch-ancestors-link",
+                            href="",
+                            className="btn btn-success",
+                            style={**CUSTOM_CSS["button"], "display": "none"},
+                        ),
+                        html.Div(id="terminal-branch-ancestors-table", style=CUSTOM_CSS["table_wrap"]),
+                    ]
+                ),
+                className="mb-3",
+            )
+        )
+
+    if "whole-pedigree-inbreeding" in selected_functions:
+        modules.append(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H4("Inbreeding coefficients for the whole pedigree"),
+                        html.P(
+                            "Computes the inbreeding coefficient F (and the A-matrix diagonal, 1 + F) for every line in the "
+                            "active pedigree without building a kinship matrix, then summarizes F by inferred era."
+                        ),
+                        html.Button("Compute Inbreeding", id="generate-inbreeding-button", style=CUSTOM_CSS["button"]),
+                        html.A(
+                            "Download Inbreeding CSV",
+                            id="download-inbreeding-link",
+                            href="",
+                            className="btn btn-success",
+                            style={**CUSTOM_CSS["button"], "display": "none"},
+                        ),
+                        html.Div(id="inbreeding-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        dcc.Loading(dcc.Graph(id="inbreeding-era-plot", config=HIGHRES_GRAPH_CONFIG), type="default"),
+                        html.H5("Most inbred lines"),
+                        html.Div(id="inbreeding-table", style=CUSTOM_CSS["table_wrap"]),
                     ]
                 ),
                 className="mb-3",
             )
         )
 
-    if "direct-line-ancestors" in selected_functions:
+    if "whole-pedigree-ainverse" in selected_functions:
         modules.append(
             dbc.Card(
                 dbc.CardBody(
                     [
-                        html.H4("Furthest direct male/female ancestors"),
+                        html.H4("Sparse A-inverse for mixed models"),
                         html.P(
-                            "Paste genotype names and the app will follow the direct male line "
-                            "(male parent of male parent, etc.) and direct female line "
-                            "(female parent of female parent, etc.) until each side terminates."
+                            "Builds the inverse relationship matrix for the whole active pedigree directly from Henderson's rules, "
+                            "without forming A. The download lists the lower triangle as Row, Column, Value triplets (1-based, "
+                            "parents before progeny) with the matching line names."
+                        ),
+                        dcc.RadioItems(
+                            id="ainverse-method-radio",
+                            options=[
+                                {"label": "Inverse of additive relationship (A)", "value": 0},
+                                {"label": "Inverse of co-ancestry (A / 2)", "value": 1},
+                            ],
+                            value=0,
+                            inline=True,
+                        ),
+                        html.Button("Build A-inverse", id="generate-ainverse-button", style=CUSTOM_CSS["button"]),
+                        html.A(
+                            "Download A-inverse Triplets",
+                            id="download-ainverse-link",
+                            href="",
+                            className="btn btn-success",
+                            style={**CUSTOM_CSS["button"], "display": "none"},
+                        ),
+                        dcc.Loading(html.Div(id="ainverse-summary", style={"fontWeight": "bold", "marginTop": "10px"}), type="default"),
+                    ]
+                ),
+                className="mb-3",
+            )
+        )
+
+    if "pairwise-kinship" in selected_functions:
+        modules.append(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H4("Pairwise kinship lookup"),
+                        html.P(
+                            "Paste one pair per line (line1|line2, or two comma/tab separated names) or upload a two-column "
+                            "file. Values are traced through the whole pedigree without building a matrix; the same lookup "
+                            "is available as JSON at /api/kinship?pairs=line1|line2;line3|line4."
                         ),
                         dcc.Textarea(
-                            id="direct-line-genotype-input",
-                            placeholder="Examples:\nL01-299\nHoCP96-540\nLCP85-384",
+                            id="pairwise-kinship-input",
+                            placeholder="Examples:\nL01-299|HoCP96-540\nCP09-1874,CP07-2547",
                             style={"width": "100%", "height": "130px"},
                         ),
-                        html.Br(),
-                        html.Button("Find Furthest Direct Ancestors", id="generate-direct-line-ancestors-button", style=CUSTOM_CSS["button"]),
-                        html.Div(id="direct-line-ancestors-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        dcc.Upload(
+                            id="pairwise-kinship-upload",
+                            children=html.Div(["Drag & Drop or ", html.A("Select a Pair File")]),
+                            style={
+                                "width": "100%",
+                                "height": "50px",
+                                "lineHeight": "50px",
+                                "borderWidth": "1px",
+                                "borderStyle": "dashed",
+                                "borderRadius": "5px",
+                                "textAlign": "center",
+                                "marginTop": "6px",
+                            },
+                            multiple=False,
+                        ),
+                        dcc.RadioItems(
+                            id="pairwise-kinship-method-radio",
+                            options=[
+                                {"label": "Additive relationship (A)", "value": 0},
+                                {"label": "Co-ancestry (A / 2)", "value": 1},
+                            ],
+                            value=0,
+                            inline=True,
+                        ),
+                        html.Button("Look Up Kinship", id="generate-pairwise-kinship-button", style=CUSTOM_CSS["button"]),
                         html.A(
-                            "Download Direct-Line Ancestor Table",
-                            id="download-direct-line-ancestors-link",
+                            "Download Pairwise Kinship CSV",
+                            id="download-pairwise-kinship-link",
                             href="",
                             className="btn btn-success",
                             style={**CUSTOM_CSS["button"], "display": "none"},
                         ),
-                        html.Div(id="direct-line-ancestors-table", style=CUSTOM_CSS["table_wrap"]),
+                        html.Div(id="pairwise-kinship-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        html.Div(id="pairwise-kinship-table", style=CUSTOM_CSS["table_wrap"]),
                     ]
                 ),
                 className="mb-3",
             )
         )
 
-
-
-    if "terminal-branch-ancestors" in selected_functions:
+    if "mean-kinship" in selected_functions:
         modules.append(
             dbc.Card(
                 dbc.CardBody(
                     [
-                        html.H4("Terminal ancestors by male/female branch"),
+                        html.H4("Mean kinship to the population or a group"),
                         html.P(
-                            "Paste genotype names and the app will return every terminal/founder ancestor path found separately "
-                            "from the input genotype's MaleParent branch and FemaleParent branch. The output is long-format "
-                            "so it can be analyzed for cytoplasmic/chloroplast inheritance. Rows where AllFemaleParentPath is TRUE "
-                            "are the direct maternal-line candidates."
+                            "Computes every line's average relationship to the whole active pedigree, or to the group pasted "
+                            "below, without a kinship matrix. Add a weight after a name (name,weight) to weight the group; "
+                            "weights are scaled to sum to 1."
                         ),
                         dcc.Textarea(
-                            id="terminal-branch-genotype-input",
-                            placeholder="Examples:\nL01-299\nHoCP96-540\nLCP85-384",
-                            style={"width": "100%", "height": "140px"},
+                            id="mean-kinship-group-input",
+                            placeholder="Leave empty for the whole pedigree, or e.g.\nCP09-1874\nHoCP96-540,2",
+                            style={"width": "100%", "height": "110px"},
                         ),
-                        html.Br(),
-                        dbc.Row(
-                            [
-                                dbc.Col(
-                                    [
-                                        html.Label("Max generations to search", style={"fontWeight": "bold"}),
-                                        dcc.Input(
-                                            id="terminal-branch-max-depth",
-                                            type="number",
-                                            min=1,
-                                            max=30,
-                                            step=1,
-                                            value=12,
-                                            style={"width": "100%"},
-                                        ),
-                                    ],
-                                    width=3,
-                                ),
-                            ]
+                        dcc.RadioItems(
+                            id="mean-kinship-method-radio",
+                            options=[
+                                {"label": "Additive relationship (A)", "value": 0},
+                                {"label": "Co-ancestry (A / 2)", "value": 1},
+                            ],
+                            value=0,
+                            inline=True,
+                        ),
+                        html.Button("Compute Mean Kinship", id="generate-mean-kinship-button", style=CUSTOM_CSS["button"]),
+                        html.A(
+                            "Download Mean Kinship CSV",
+                            id="download-mean-kinship-link",
+                            href="",
+                            className="btn btn-success",
+                            style={**CUSTOM_CSS["button"], "display": "none"},
+                        ),
+                        html.Div(id="mean-kinship-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        dcc.Loading(dcc.Graph(id="mean-kinship-histogram", config=HIGHRES_GRAPH_CONFIG), type="default"),
+                        html.H5("Least related lines"),
+                        html.Div(id="mean-kinship-table", style=CUSTOM_CSS["table_wrap"]),
+                    ]
+                ),
+                className="mb-3",
+            )
+        )
+
+    if "core-set" in selected_functions:
+        modules.append(
+            dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H4("Diversity core set (greedy minimum coancestry)"),
+                        html.P(
+                            "Picks k parents from the candidate list one at a time, each time adding the line that keeps the "
+                            "group's mean coancestry lowest. Leave the list empty to choose from the whole active pedigree."
+                        ),
+                        dcc.Textarea(
+                            id="core-set-candidates",
+                            placeholder="Candidate lines (one per line or comma-separated)",
+                            style={"width": "100%", "height": "130px"},
                         ),
+                        html.Label("Core set size k", style={"marginRight": "8px"}),
+                        dcc.Input(id="core-set-size", type="number", value=20, min=1, step=1, style={"width": "100px"}),
                         html.Br(),
-                        html.Button("Find Terminal Branch Ancestors", id="generate-terminal-branch-ancestors-button", style=CUSTOM_CSS["button"]),
-                        html.Div(id="terminal-branch-ancestors-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        html.Button("Select Core Set", id="generate-core-set-button", style=CUSTOM_CSS["button"]),
                         html.A(
-                            "Download Terminal Branch Ancestor CSV",
-                            id="download-terminal-branch-ancestors-link",
+                            "Download Core Set CSV",
+                            id="download-core-set-link",
                             href="",
                             className="btn btn-success",
                             style={**CUSTOM_CSS["button"], "display": "none"},
                         ),
-                        html.Div(id="terminal-branch-ancestors-table", style=CUSTOM_CSS["table_wrap"]),
+                        html.Div(id="core-set-summary", style={"fontWeight": "bold", "marginTop": "10px"}),
+                        dcc.Loading(dcc.Graph(id="core-set-plot", config=HIGHRES_GRAPH_CONFIG), type="default"),
+                        html.Div(id="core-set-table", style=CUSTOM_CSS["table_wrap"]),
                     ]
                 ),
                 className="mb-3",
@@ -2803,13 +5267,19 @@ def display_selected_progeny_modules(selected_functions):
 def find_progeny(n_clicks, female_parent, male_parent):
     if not n_clicks or not female_parent or not male_parent:
         raise PreventUpdate
-    matches = filtered_df[
-        (filtered_df["FemaleParent"].map(clean_parent_value) == female_parent)
-        & (filtered_df["MaleParent"].map(clean_parent_value) == male_parent)
-    ]
-    if matches.empty:
+    graph = get_pedigree_graph(filtered_df)
+    female_id = graph.index.get(female_parent)
+    male_id = graph.index.get(male_parent)
+    matches = []
+    if female_id is not None and male_id is not None:
+        matches = [
+            graph.names[child]
+            for child in dict.fromkeys(graph.children_of(female_id).tolist())
+            if graph.dams[child] == female_id and graph.sires[child] == male_id
+        ]
+    if not matches:
         return "No progeny found for this pairing."
-    return html.Ul([html.Li(row["LineName"]) for _, row in matches.iterrows()])
+    return html.Ul([html.Li(name) for name in matches])
 
 
 @app.callback(
@@ -2821,16 +5291,15 @@ def find_progeny(n_clicks, female_parent, male_parent):
 def find_single_parent_progeny(n_clicks, parent):
     if not n_clicks or not parent:
         raise PreventUpdate
-    matches = filtered_df[
-        (filtered_df["FemaleParent"].map(clean_parent_value) == parent)
-        | (filtered_df["MaleParent"].map(clean_parent_value) == parent)
-    ]
-    if matches.empty:
+    graph = get_pedigree_graph(filtered_df)
+    parent_id = graph.index.get(parent)
+    if parent_id is None or graph.child_ptr[parent_id] == graph.child_ptr[parent_id + 1]:
         return "No progeny found for this parent."
 
     items = []
-    for _, row in matches.iterrows():
-        items.append(html.Li(f"{row['LineName']} (Female: {row['FemaleParent']}; Male: {row['MaleParent']})"))
+    for child in dict.fromkeys(graph.children_of(parent_id).tolist()):
+        male, female = graph.parents(graph.names[child])
+        items.append(html.Li(f"{graph.names[child]} (Female: {female or ''}; Male: {male or ''})"))
     return html.Ul(items)
 
 
@@ -2977,22 +5446,18 @@ def generate_family_tree(n_clicks, lineage_mode, selected_line_name, generation_
     if not n_clicks or not selected_line_name:
         raise PreventUpdate
 
-    all_ancestors, relationships, generations = find_ancestors(selected_line_name, filtered_df)
-    full_nodes = all_ancestors.union({selected_line_name})
-    full_relatives_df = filtered_df[filtered_df["LineName"].isin(full_nodes)].copy()
-    full_matrix = compute_selected_matrix(full_relatives_df, method_choice)
+    import graphviz
+    from matplotlib import cm
+    from matplotlib.colors import Normalize
+
+    _, relationships, generations = find_ancestors(selected_line_name, filtered_df)
 
     subset_nodes: set[str] = {selected_line_name}
     for gen in range((generation_depth or 0) + 1):
         subset_nodes.update(generations.get(gen, []))
     subset_relationships = [(p, c, role) for p, c, role in relationships if p in subset_nodes and c in subset_nodes]
 
-    kinship_values = {}
-    for line in subset_nodes:
-        if selected_line_name in full_matrix.index and line in full_matrix.columns:
-            kinship_values[line] = float(full_matrix.loc[selected_line_name, line])
-        else:
-            kinship_values[line] = 0.0
+    kinship_values = kinship_vector(selected_line_name, subset_nodes, filtered_df, method_choice).to_dict()
 
     parent_count = {line: 0 for line in subset_nodes}
     for parent, child, _ in subset_relationships:
@@ -3084,6 +5549,9 @@ def generate_family_tree(n_clicks, lineage_mode, selected_line_name, generation_
 def generate_descendant_tree(n_clicks, selected_line_name):
     if not n_clicks or not selected_line_name:
         raise PreventUpdate
+
+    import graphviz
+
     descendants, relationships, generations = find_descendants(selected_line_name, filtered_df)
     nodes = descendants.union({selected_line_name})
     dot = graphviz.Digraph(comment="Descendant Tree")
@@ -3110,6 +5578,8 @@ def generate_combined_family_tree(n_clicks, line1, line2):
     if not n_clicks or not line1 or not line2:
         raise PreventUpdate
 
+    import graphviz
+
     ancestors1, relationships1, _ = find_ancestors(line1, filtered_df)
     ancestors2, relationships2, _ = find_ancestors(line2, filtered_df)
     all_lines = ancestors1.union(ancestors2, {line1, line2})
@@ -3153,23 +5623,17 @@ def generate_temp_progeny_tree(n_clicks, female_parent, male_parent, method_choi
     if not n_clicks or not female_parent or not male_parent:
         raise PreventUpdate
 
+    import graphviz
+
     temp_progeny_name = f"Temp_Progeny_{int(time.time())}"
     temp_row = pd.DataFrame(
         [{"LineName": temp_progeny_name, "FemaleParent": female_parent, "MaleParent": male_parent}]
     )
-    temp_df = pd.concat([filtered_df, temp_row], ignore_index=True)
+    temp_graph = get_pedigree_graph(pd.concat([filtered_df, temp_row], ignore_index=True))
 
-    ancestors, relationships, _ = find_ancestors(temp_progeny_name, temp_df)
+    ancestors, relationships, _ = find_ancestors(temp_progeny_name, temp_graph)
     all_lines = ancestors.union({temp_progeny_name})
-    relatives_df = temp_df[temp_df["LineName"].isin(all_lines)].copy()
-    kinship_matrix = compute_selected_matrix(relatives_df, method_choice)
-
-    kinship_values = {}
-    for line in all_lines:
-        if temp_progeny_name in kinship_matrix.index and line in kinship_matrix.columns:
-            kinship_values[line] = float(kinship_matrix.loc[temp_progeny_name, line])
-        else:
-            kinship_values[line] = 0.0
+    kinship_values = kinship_vector(temp_progeny_name, all_lines, temp_graph, method_choice).to_dict()
     non_self_values = [v for k, v in kinship_values.items() if k != temp_progeny_name]
     q25, q50 = np.quantile(non_self_values, [0.25, 0.5]) if non_self_values else (0, 0)
 
@@ -3197,6 +5661,285 @@ def generate_temp_progeny_tree(n_clicks, female_parent, male_parent, method_choi
     return graphviz_visualization_block(dot, f"temporary_progeny_tree_{female_parent}_{male_parent}")
 
 
+@app.callback(
+    [
+        Output("crossing-block-summary", "children"),
+        Output("crossing-block-table", "children"),
+        Output("download-crossing-block-link", "href"),
+        Output("download-crossing-block-link", "style"),
+    ],
+    Input("generate-crossing-block-button", "n_clicks"),
+    [
+        State("crossing-block-females", "value"),
+        State("crossing-block-males", "value"),
+        State("crossing-block-order-radio", "value"),
+        State("crossing-block-top-k", "value"),
+    ],
+    prevent_initial_call=True,
+)
+def generate_crossing_block(n_clicks, female_text, male_text, order, top_k):
+    if not n_clicks:
+        raise PreventUpdate
+
+    females = [name.strip() for name in re.split(r"[,;\t\n]+", female_text or "") if name.strip()]
+    males = [name.strip() for name in re.split(r"[,;\t\n]+", male_text or "") if name.strip()]
+    start_time = time.time()
+    result_df = evaluate_crossing_block(females, males, filtered_df)
+    elapsed = time.time() - start_time
+    hidden = {**CUSTOM_CSS["button"], "display": "none"}
+    if result_df.empty:
+        return "Enter at least one female and one male parent found in the active pedigree.", None, "", hidden
+
+    if order == "highest":
+        result_df = result_df.iloc[::-1].reset_index(drop=True)
+        result_df["Rank"] = np.arange(1, len(result_df) + 1)
+    file_path = OUTPUT_DIR / f"crossing_block_{int(time.time())}.csv"
+    result_df.to_csv(file_path, index=False)
+    href = f"/download?filename={urllib.parse.quote(str(file_path))}&type=csv"
+
+    n_females = result_df["FemaleParent"].nunique()
+    n_males = result_df["MaleParent"].nunique()
+    summary = (
+        f"Scored {len(result_df):,} crosses ({n_females:,} females × {n_males:,} males) in {elapsed:.2f} seconds. "
+        f"Expected progeny F ranges from {result_df['ExpectedProgenyF'].min():.4f} to {result_df['ExpectedProgenyF'].max():.4f}."
+    )
+    top_df = result_df.head(max(1, int(top_k or 50))).round({"ExpectedProgenyF": 4})
+    table = dataframe_to_dash_table(top_df, max_rows=len(top_df))
+    return summary, table, href, {**CUSTOM_CSS["button"], "display": "inline-block"}
+
+
+@app.callback(
+    [
+        Output("inbreeding-summary", "children"),
+        Output("inbreeding-era-plot", "figure"),
+        Output("inbreeding-table", "children"),
+        Output("download-inbreeding-link", "href"),
+        Output("download-inbreeding-link", "style"),
+    ],
+    Input("generate-inbreeding-button", "n_clicks"),
+    prevent_initial_call=True,
+)
+def generate_whole_pedigree_inbreeding(n_clicks):
+    if not n_clicks:
+        raise PreventUpdate
+
+    start_time = time.time()
+    result_df = inbreeding_table(df)
+    elapsed = time.time() - start_time
+
+    file_path = OUTPUT_DIR / f"inbreeding_{int(time.time())}.csv"
+    result_df.to_csv(file_path, index=False)
+    href = f"/download?filename={urllib.parse.quote(str(file_path))}&type=csv"
+
+    summary = (
+        f"Computed F for {len(result_df):,} lines in {elapsed:.2f} seconds. "
+        f"{int((result_df['Inbreeding'] > 0).sum()):,} lines are inbred; mean F = {result_df['Inbreeding'].mean():.4f}, "
+        f"max F = {result_df['Inbreeding'].max():.4f}."
+    )
+
+    era_df = (
+        result_df.groupby("Era", as_index=False)
+        .agg(MeanF=("Inbreeding", "mean"), Lines=("LineName", "size"))
+        .sort_values("Era")
+    )
+    fig = go.Figure(
+        go.Bar(
+            x=era_df["Era"],
+            y=era_df["MeanF"],
+            customdata=era_df["Lines"],
+            hovertemplate="Era: %{x}<br>Mean F: %{y:.4f}<br>Lines: %{customdata}<extra></extra>",
+        )
+    )
+    fig.update_layout(title="Mean inbreeding by inferred era", xaxis_title="Inferred era", yaxis_title="Mean F", height=460)
+
+    top_df = result_df.nlargest(100, "Inbreeding").round({"Inbreeding": 4, "Diagonal": 4})
+    table = dataframe_to_dash_table(top_df, max_rows=100)
+    return summary, fig, table, href, {**CUSTOM_CSS["button"], "display": "inline-block"}
+
+
+@app.callback(
+    [
+        Output("ainverse-summary", "children"),
+        Output("download-ainverse-link", "href"),
+        Output("download-ainverse-link", "style"),
+    ],
+    Input("generate-ainverse-button", "n_clicks"),
+    State("ainverse-method-radio", "value"),
+    prevent_initial_call=True,
+)
+def generate_whole_pedigree_ainverse(n_clicks, method_choice):
+    if not n_clicks:
+        raise PreventUpdate
+
+    start_time = time.time()
+    names, inverse = amatrix_inverse(df, method_choice or 0)
+    elapsed = time.time() - start_time
+
+    file_path = OUTPUT_DIR / f"ainverse_triplets_{int(time.time())}.csv"
+    triplets = sparse_triplets(names, inverse)
+    triplets.to_csv(file_path, index=False)
+    href = f"/download?filename={urllib.parse.quote(str(file_path))}&type=csv"
+
+    summary = (
+        f"Built a {len(names):,} x {len(names):,} A-inverse in {elapsed:.2f} seconds with {inverse.nnz:,} non-zero entries "
+        f"({len(triplets):,} lower-triangle triplets)."
+    )
+    return summary, href, {**CUSTOM_CSS["button"], "display": "inline-block"}
+
+
+@app.callback(
+    [
+        Output("pairwise-kinship-summary", "children"),
+        Output("pairwise-kinship-table", "children"),
+        Output("download-pairwise-kinship-link", "href"),
+        Output("download-pairwise-kinship-link", "style"),
+    ],
+    Input("generate-pairwise-kinship-button", "n_clicks"),
+    [
+        State("pairwise-kinship-input", "value"),
+        State("pairwise-kinship-upload", "contents"),
+        State("pairwise-kinship-method-radio", "value"),
+    ],
+    prevent_initial_call=True,
+)
+def generate_pairwise_kinship(n_clicks, pasted_text, upload_contents, method_choice):
+    if not n_clicks:
+        raise PreventUpdate
+
+    text = pasted_text or ""
+    if upload_contents:
+        _, content_string = upload_contents.split(",", 1)
+        text += "\n" + base64.b64decode(content_string).decode("utf-8", errors="replace")
+    pairs = parse_kinship_pairs(text)
+    hidden = {**CUSTOM_CSS["button"], "display": "none"}
+    if not pairs:
+        return "Enter or upload at least one pair of line names.", None, "", hidden
+
+    start_time = time.time()
+    result_df = pairwise_kinship(pairs, df, method_choice or 0)
+    elapsed = time.time() - start_time
+
+    file_path = OUTPUT_DIR / f"pairwise_kinship_{int(time.time())}.csv"
+    result_df.to_csv(file_path, index=False)
+    href = f"/download?filename={urllib.parse.quote(str(file_path))}&type=csv"
+
+    n_missing = int(result_df["Kinship"].isna().sum())
+    summary = f"Looked up {len(result_df):,} pairs in {elapsed * 1000:.0f} ms."
+    if n_missing:
+        summary += f" {n_missing:,} pairs name a line that is not in the pedigree."
+    table = dataframe_to_dash_table(result_df.round({"Kinship": 4}), max_rows=500)
+    return summary, table, href, {**CUSTOM_CSS["button"], "display": "inline-block"}
+
+
+@app.callback(
+    [
+        Output("mean-kinship-summary", "children"),
+        Output("mean-kinship-histogram", "figure"),
+        Output("mean-kinship-table", "children"),
+        Output("download-mean-kinship-link", "href"),
+        Output("download-mean-kinship-link", "style"),
+    ],
+    Input("generate-mean-kinship-button", "n_clicks"),
+    [State("mean-kinship-group-input", "value"), State("mean-kinship-method-radio", "value")],
+    prevent_initial_call=True,
+)
+def generate_mean_kinship(n_clicks, group_text, method_choice):
+    if not n_clicks:
+        raise PreventUpdate
+
+    weights = None
+    for record in (group_text or "").splitlines():
+        fields = [part.strip() for part in re.split(r"[,\t]", record) if part.strip()]
+        if not fields:
+            continue
+        try:
+            weight = float(fields[1]) if len(fields) > 1 else 1.0
+        except ValueError:
+            weight = 1.0
+        weights = weights or {}
+        weights[fields[0]] = weights.get(fields[0], 0.0) + weight
+
+    graph = get_pedigree_graph(df)
+    hidden = {**CUSTOM_CSS["button"], "display": "none"}
+    if weights is not None:
+        found = [weights[line] for line in weights if graph.has_line(line)]
+        if not found:
+            return "None of the group lines are in the pedigree.", go.Figure(), None, "", hidden
+        if sum(found) == 0:
+            return "The group weights sum to zero; give the group a non-zero total weight.", go.Figure(), None, "", hidden
+
+    start_time = time.time()
+    result_df = mean_kinship_table(weights, df, method_choice or 0)
+    elapsed = time.time() - start_time
+    if result_df.empty:
+        return "The pedigree has no lines.", go.Figure(), None, "", hidden
+
+    file_path = OUTPUT_DIR / f"mean_kinship_{int(time.time())}.csv"
+    result_df.to_csv(file_path, index=False)
+    href = f"/download?filename={urllib.parse.quote(str(file_path))}&type=csv"
+
+    reference = "the whole pedigree" if weights is None else f"a group of {sum(map(graph.has_line, weights)):,} lines"
+    summary = (
+        f"Computed mean kinship of {len(result_df):,} lines to {reference} in {elapsed:.2f} seconds. "
+        f"Median {result_df['MeanKinship'].median():.4f}, max {result_df['MeanKinship'].max():.4f} "
+        f"({result_df['LineName'].iloc[-1]})."
+    )
+    fig = go.Figure(go.Histogram(x=result_df["MeanKinship"], nbinsx=60))
+    fig.update_layout(title=f"Mean kinship to {reference}", xaxis_title="Mean kinship", yaxis_title="Lines", height=420)
+    table = dataframe_to_dash_table(result_df.head(100).round({"MeanKinship": 4}), max_rows=100)
+    return summary, fig, table, href, {**CUSTOM_CSS["button"], "display": "inline-block"}
+
+
+@app.callback(
+    [
+        Output("core-set-summary", "children"),
+        Output("core-set-plot", "figure"),
+        Output("core-set-table", "children"),
+        Output("download-core-set-link", "href"),
+        Output("download-core-set-link", "style"),
+    ],
+    Input("generate-core-set-button", "n_clicks"),
+    [State("core-set-candidates", "value"), State("core-set-size", "value")],
+    prevent_initial_call=True,
+)
+def generate_core_set(n_clicks, candidate_text, k):
+    if not n_clicks:
+        raise PreventUpdate
+
+    candidates = [name.strip() for name in re.split(r"[,;\t\n]+", candidate_text or "") if name.strip()]
+    if not candidates:
+        graph = get_pedigree_graph(filtered_df)
+        candidates = graph.names[:graph.n_lines]
+    start_time = time.time()
+    result_df = greedy_core_set(candidates, int(k or 0), filtered_df)
+    elapsed = time.time() - start_time
+    if result_df.empty:
+        return "Enter candidate lines found in the active pedigree and a core set size of at least 1.", go.Figure(), None, "", {**CUSTOM_CSS["button"], "display": "none"}
+
+    file_path = OUTPUT_DIR / f"core_set_{int(time.time())}.csv"
+    result_df.to_csv(file_path, index=False)
+    href = f"/download?filename={urllib.parse.quote(str(file_path))}&type=csv"
+
+    summary = (
+        f"Selected {len(result_df):,} of {len(dict.fromkeys(candidates)):,} candidates in {elapsed:.2f} seconds; "
+        f"group mean coancestry {result_df['GroupMeanCoancestry'].iloc[-1]:.4f}."
+    )
+    fig = go.Figure(
+        go.Scatter(
+            x=result_df["Step"],
+            y=result_df["GroupMeanCoancestry"],
+            mode="lines+markers",
+            text=result_df["LineName"],
+            hovertemplate="Step %{x}: %{text}<br>Group mean coancestry: %{y:.4f}<extra></extra>",
+        )
+    )
+    fig.update_layout(title="Group mean coancestry as lines are added", xaxis_title="Core set size", yaxis_title="Mean coancestry", height=420)
+    table = dataframe_to_dash_table(
+        result_df.round({"Inbreeding": 4, "CoancestryToSet": 4, "GroupMeanCoancestry": 4}), max_rows=len(result_df)
+    )
+    return summary, fig, table, href, {**CUSTOM_CSS["button"], "display": "inline-block"}
+
+
 # =============================================================================
 # New visualization callbacks: matrix ordination, group insights, ancestor contribution,
 # Cytoscape interactive viewer, and generation-ring layout
@@ -3218,7 +5961,7 @@ def update_matrix_ordination_plot(matrix_data, method, label_values):
         fig.update_layout(title="Matrix file not found. Regenerate the matrix.", height=420)
         return fig
     try:
-        matrix_df = pd.read_csv(matrix_path, index_col=0)
+        matrix_df = read_matrix_subset(matrix_path, plot_sample_lines(read_matrix_lines(matrix_path)))
         ord_df = matrix_to_ordination(matrix_df, method or "mds")
         show_labels = bool(label_values and "labels" in label_values)
         return build_ordination_figure(ord_df, method or "mds", show_labels)
@@ -3416,6 +6159,34 @@ def download_file():
         return "File not found", 404
 
     suffix = Path(filename).suffix.lower()
+    if suffix == ".npy":
+        if file_type == "npz":
+            return send_file(export_matrix_npz(filename), mimetype="application/octet-stream", as_attachment=True, download_name="kinship_matrix.npz")
+        if file_type == "parquet":
+            if not HAS_PYARROW:
+                return "Parquet export needs pyarrow (pip install pyarrow)", 501
+            return send_file(export_matrix_parquet(filename), mimetype="application/vnd.apache.parquet", as_attachment=True, download_name="kinship_matrix.parquet")
+        # Stored matrices are streamed as CSV straight from the memmap.
+        if file_type == "long":
+            try:
+                threshold = float(flask.request.args.get("threshold") or 0.0)
+            except ValueError:
+                threshold = 0.0
+            chunks = iter_matrix_long_csv(filename, threshold)
+            download_name = "kinship_long.csv"
+        else:
+            chunks = iter_matrix_csv(filename)
+            download_name = "full_matrix.csv"
+        mimetype = "text/csv"
+        if flask.request.args.get("compression") == "gzip":
+            chunks = gzip_chunks(chunks)
+            download_name += ".gz"
+            mimetype = "application/gzip"
+        return flask.Response(
+            flask.stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f'attachment; filename="{download_name}"'},
+        )
     if file_type == "image":
         return send_file(filename, mimetype="image/png", as_attachment=False)
 
@@ -3437,5 +6208,59 @@ def download_file():
     return send_file(filename, mimetype="text/csv", as_attachment=True, download_name=download_name)
 
 
+@app.server.route("/ready")
+def ready():
+    """Readiness probe: 200 once the startup pedigrees are loaded and indexed, 503 before."""
+    if not pedigree_ready.is_set():
+        return flask.jsonify({"ready": False}), 503
+    return flask.jsonify(
+        {
+            "ready": True,
+            "rows": len(df),
+            "indexed_rows": len(filtered_df),
+            "index_seconds": round(startup_stats.get("index_seconds", 0.0), 3),
+            "warmup_seconds": round(startup_stats.get("warmup_seconds", 0.0), 3),
+        }
+    )
+
+
+@app.server.route("/api/kinship", methods=["GET", "POST"])
+def kinship_api():
+    """
+    Pairwise kinship as JSON, e.g. /api/kinship?pairs=L01-299|HoCP96-540;CP09-1874|CP07-2547.
+
+    Large batches can be POSTed as a "pairs" form field or as the raw request
+    body, one pair per line. method=coancestry returns A / 2.
+    """
+    text = flask.request.values.get("pairs")
+    if text is None and flask.request.method == "POST":
+        text = flask.request.get_data(as_text=True)
+    pairs = parse_kinship_pairs(text or "")
+    if not pairs:
+        return flask.jsonify({"error": "Pass pairs as 'line1|line2' separated by ';' or newlines."}), 400
+
+    method = str(flask.request.values.get("method", "additive")).lower()
+    method_choice = 1 if method in {"1", "coancestry", "co-ancestry"} else 0
+    result = pairwise_kinship(pairs, df, method_choice)
+    graph = get_pedigree_graph(df)
+    return flask.jsonify(
+        {
+            "method": "coancestry" if method_choice else "additive",
+            "results": [
+                {"line1": line1, "line2": line2, "kinship": None if np.isnan(value) else float(value)}
+                for line1, line2, value in result.itertuples(index=False)
+            ],
+            "not_found": sorted({name for pair in pairs for name in pair if not graph.has_line(name)}),
+        }
+    )
+
+
+# Load (and optionally warm up) last, once every kernel and route is defined.
+if BACKGROUND_INDEXING:
+    threading.Thread(target=load_startup_pedigrees, name="pedigree-indexing", daemon=True).start()
+else:
+    load_startup_pedigrees()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8050, debug=False)